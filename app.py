@@ -1,10 +1,110 @@
+import os
+import time
+
 import streamlit as st
 import pandas as pd
-import re
 import openai
 
+from llm_eval.batch import (
+    TERMINAL_STATUSES, fetch_results, job_fingerprints, list_jobs, refresh_job, result_rows, submit_evaluation
+)
+from llm_eval.cache import ResponseCache
+from llm_eval.cascade import DEFAULT_MARGIN, DEFAULT_SAMPLE_RATE, cascade_settings
+from llm_eval.engine import DEFAULT_CONCURRENCY, DEFAULT_TIMEOUT
+from llm_eval.evaluate import iter_fused_results, iter_metric_results
+from llm_eval.loading import REQUIRED_COLUMNS, Sheet, detect_mode, missing_columns, needed_columns
+from llm_eval.prompts import DEFAULT_MODELS, MAX_SYSTEM_PROMPT_TOKENS, context_window, default_system_prompt
+from llm_eval.results import DEFAULT_PASS_THRESHOLD
+from llm_eval.runlog import RunLog, grading_fingerprints, new_run_id
+from llm_eval.scheduler import DEFAULT_RPM, DEFAULT_TPM
+from llm_eval.timing import RENDERING, RunStats
+from llm_eval.tokens import count_tokens
+
 # Set OpenAI API key
 openai.api_key = st.secrets["OPENAI_API_KEY"]
+# Groq judges are optional
+if "GROQ_API_KEY" in st.secrets:
+    os.environ.setdefault("GROQ_API_KEY", st.secrets["GROQ_API_KEY"])
+
+
+@st.cache_resource
+def get_response_cache() -> ResponseCache:
+    """
+    Open the on-disk judge response cache once per server process.
+    """
+    return ResponseCache()
+
+
+@st.cache_resource
+def get_run_log() -> RunLog:
+    """
+    Open the run log that every graded row is appended to.
+    """
+    return RunLog()
+
+
+LIVE_REFRESH_SECONDS = 1.0
+
+
+def show_progress(panel, stats: RunStats):
+    """
+    Draw the run's throughput, call latencies and time per stage into `panel`.
+    """
+    summary = stats.summary()
+    with panel.container():
+        results_column, rate_column, tokens_column = st.columns(3)
+        results_column.metric("Results", summary["results"])
+        rate_column.metric("Rows/s", summary["rows_per_s"])
+        tokens_column.metric("Tokens/s", f"{summary['tokens_per_s']:,.0f}")
+        if summary["calls"]:
+            latency = f"latency p50 {summary['p50_ms']} ms, p95 {summary['p95_ms']} ms, p99 {summary['p99_ms']} ms"
+        else:
+            latency = "every response so far came from the cache"
+        stages = ", ".join(f"{stage} {seconds}" for stage, seconds in summary["stages_s"].items())
+        st.caption(f"{summary['calls']} judge calls, {latency}. Seconds per stage: {stages}")
+        duplicates = summary["duplicates"]
+        st.caption(
+            f"{summary['prompt_cache_rate']:.0%} of prompt tokens served from the provider's prompt cache; "
+            f"{duplicates['rows']} duplicate rows reused an identical row's grade, saving "
+            f"{duplicates['requests_saved']} calls and {duplicates['tokens_saved']:,} tokens"
+        )
+        if "cascade" in summary:
+            cascade = summary["cascade"]
+            if cascade["agreement_rate"] is None:
+                agreement = "no spot checks yet"
+            else:
+                agreement = f"{cascade['agreement_rate']:.0%} agreement on {cascade['sampled']} spot checks"
+            st.caption(
+                f"Cascade: {cascade['escalated']} of {cascade['rows']} rows escalated, "
+                f"{cascade['full_requests_saved']:.0%} of full-grade calls saved, {agreement}. "
+                f"Counting the cheap pass: {cascade['net_calls']:+,} calls and {cascade['net_tokens']:+,} "
+                f"prompt tokens against grading every row in full"
+            )
+
+
+def show_live(results, heading: str, final_results, stats: RunStats):
+    """
+    Consume a stream of result rows, refreshing a table and the run's progress panel as they arrive.
+
+    Once the stream ends the table shows `final_results()`, which includes
+    rows graded by earlier attempts of a resumed run.
+    """
+    st.write(heading)
+    panel = st.empty()
+    table = st.empty()
+    shown = []
+    refreshed = time.monotonic()
+    for result in results:
+        shown.append(result)
+        if time.monotonic() - refreshed >= LIVE_REFRESH_SECONDS:
+            with stats.stage(RENDERING):
+                table.dataframe(pd.DataFrame(shown))
+            show_progress(panel, stats)
+            refreshed = time.monotonic()
+    with stats.stage(RENDERING):
+        table.dataframe(pd.DataFrame(final_results()))
+    show_progress(panel, stats)
+
 
 # Streamlit UI
 st.title("LLM Evaluationn Tool")
@@ -12,366 +112,256 @@ st.write("Upload an Excel file for processing. The expected formats are:")
 st.write("1. Columns: Index, Question, Context, Answer, Reference Context, Reference Answer")
 st.write("2. Columns: Index, Conversation, Agent Prompt")
 
+# Grading settings shared by both evaluation paths
+st.sidebar.header("Grading Settings")
+concurrency = st.sidebar.number_input("Concurrent requests", min_value=1, max_value=64, value=DEFAULT_CONCURRENCY, step=1)
+request_timeout = st.sidebar.number_input("Request timeout (seconds)", min_value=5.0, value=DEFAULT_TIMEOUT, step=5.0)
+rpm_limit = st.sidebar.number_input("Requests per minute", min_value=1, value=DEFAULT_RPM, step=50,
+                                    help="Budget of each judge model; providers meter their models separately.")
+tpm_limit = st.sidebar.number_input("Tokens per minute", min_value=1000, value=DEFAULT_TPM, step=1000,
+                                    help="Budget of each judge model; providers meter their models separately.")
+context_budget = st.sidebar.number_input(
+    "Context budget (tokens per request)", min_value=1024, value=context_window(DEFAULT_MODELS["agentic"]), step=1024,
+    help="Conversations that do not fit are graded in windows and the grades combined."
+)
+cascade_margin = st.sidebar.number_input(
+    "Cascade margin (score points)", min_value=0.0, max_value=10.0, value=DEFAULT_MARGIN, step=0.5,
+    help="Cascaded metrics grade a row in full when its cheap score is this close to the pass threshold."
+)
+cascade_sample_rate = st.sidebar.number_input(
+    "Cascade spot-check share", min_value=0.0, max_value=1.0, value=DEFAULT_SAMPLE_RATE, step=0.01,
+    help="Share of the other rows also graded in full to measure how often the cheap score agrees."
+)
+use_cache = st.sidebar.checkbox("Reuse cached responses for unchanged prompts", value=True)
+response_cache = get_response_cache() if use_cache else None
+# Filled in at the end of the run so the counters include this rerun's calls
+cache_stats_placeholder = st.sidebar.empty()
+
+# Results are logged under the run ID as they are graded; each upload starts a new run unless one is resumed
+run_log = get_run_log()
+st.sidebar.header("Run")
+resume_run_id = st.sidebar.text_input(
+    "Resume run ID",
+    help="Enter the ID of an earlier run to resume it; rows it already graded with the same sheet and metric "
+         "settings are skipped. Left empty, each new upload starts a new run."
+).strip()
+run_caption = st.sidebar.empty()
+if "run_ids" not in st.session_state:
+    # The run started for each upload in this session, by the sheet's digest
+    st.session_state.run_ids = {}
+run_id = resume_run_id or None
+pass_threshold = st.sidebar.slider("Pass threshold (score out of 10)", min_value=0.0, max_value=10.0, value=DEFAULT_PASS_THRESHOLD, step=0.5)
+
+grading = {
+    "concurrency": concurrency,
+    "timeout": request_timeout,
+    "rpm": rpm_limit,
+    "tpm": tpm_limit,
+    "cache": response_cache
+}
+
 uploaded_file = st.file_uploader("Upload your Excel file", type=["xlsx", "csv"])
 
 if uploaded_file:
     try:
-        # Read uploaded file
-        if uploaded_file.name.endswith(".xlsx"):
-            df = pd.read_excel(uploaded_file)
+        # Rows are streamed from the upload for each run rather than loaded into a DataFrame
+        sheet = Sheet(uploaded_file.getvalue(), uploaded_file.name)
+        sheet_digest = sheet.digest()
+        run_id = resume_run_id or st.session_state.run_ids.setdefault(sheet_digest, new_run_id())
+        run_caption.caption(f"Run {run_id}: {len(run_log.done(run_id))} results logged")
+        columns = sheet.columns
+        # "rag" for Question/Context/Answer sheets, "agentic" for Conversation/Agent Prompt sheets
+        mode = detect_mode(columns)
+
+        if mode is None:
+            st.error("The uploaded file does not match either of the expected formats.")
+        elif missing_columns(mode, columns):
+            st.error(f"The uploaded file must contain these columns: {', '.join(REQUIRED_COLUMNS[mode])}.")
         else:
-            df = pd.read_csv(uploaded_file)
-
-        if "Question" in df.columns and "Context" in df.columns and "Answer" in df.columns:
-            # Code 1 processing
-            required_columns = ["Index", "Question", "Context", "Answer", "Reference Context", "Reference Answer"]
-            if not all(col in df.columns for col in required_columns):
-                st.error(f"The uploaded file must contain these columns: {', '.join(required_columns)}.")
-            else:
-                st.write("Preview of Uploaded Data:")
-                st.dataframe(df.head())
-
-                num_metrics = st.number_input("Enter the number of metrics you want to define:", min_value=1, step=1)
-
-                if "combined_results" not in st.session_state:
-                    st.session_state.combined_results = []
-
-                for i in range(num_metrics):
-                    st.markdown(f"""
-                        <hr style="border: 5px solid #000000;">
-                        <h3 style="background-color: #f0f0f0; padding: 10px; border: 2px solid #000000;">
-                            Metric {i + 1}
-                        </h3>
-                    """, unsafe_allow_html=True)
-
-                    selected_columns = st.multiselect(
-                        f"Select columns for Metric {i + 1}:",
-                        options=required_columns[1:],
-                        key=f"columns_{i}"
+            st.write("Preview of Uploaded Data:")
+            st.dataframe(sheet.head())
+
+            num_metrics = st.number_input("Enter the number of metrics you want to define:", min_value=1, step=1)
+
+            fuse_metrics = mode == "rag" and st.checkbox(
+                "Evaluate all metrics in one call per row",
+                help="Sends each row's data once to Metric 1's judge and scores every metric from a single JSON response."
+            )
+            structured_output = st.checkbox(
+                "Ask for structured JSON grades",
+                help="Constrains each reply to a JSON schema with a numeric score instead of parsing free text."
+            )
+
+            metrics = []
+            for i in range(num_metrics):
+                st.markdown(f"""
+                    <hr style="border: 5px solid #000000;">
+                    <h3 style="background-color: #f0f0f0; padding: 10px; border: 2px solid #000000;">
+                        Metric {i + 1}
+                    </h3>
+                """, unsafe_allow_html=True)
+
+                selected_columns = st.multiselect(
+                    f"Select columns for Metric {i + 1}:",
+                    options=REQUIRED_COLUMNS[mode][1:],  # Skip the Index column
+                    key=f"columns_{i}"
+                )
+
+                toggle_prompt = st.checkbox(
+                    f"Automatically generate system prompt for Metric {i + 1}", key=f"toggle_prompt_{i}"
+                )
+
+                if toggle_prompt:
+                    system_prompt = default_system_prompt(mode, i)
+                    st.text_area(
+                        f"Generated System Prompt for Metric {i + 1}:",
+                        value=system_prompt,
+                        height=200
                     )
-
-                    toggle_prompt = st.checkbox(
-                        f"Automatically generate system prompt for Metric {i + 1}", key=f"toggle_prompt_{i}"
+                    if mode == "agentic":
+                        st.success(f"System Prompt for Metric {i + 1} is Generated")
+                else:
+                    system_prompt = st.text_area(
+                        f"Enter the System Prompt for Metric {i + 1}:",
+                        height=200
                     )
 
-                    if toggle_prompt:
-                        if i % 2 == 0:
-                            system_prompt = """You are a RELEVANCE grader; providing the relevance of the given question to the given answer.
-                                            Respond only as a number from 0 to 10 where 0 is the least relevant and 10 is the most relevant. 
-                                        
-                                            A few additional scoring guidelines:
-                                            - Long answer should score equally well as short answer.
-                                            - RELEVANCE score should increase as the answer provides more RELEVANT context to the question.
-                                            - RELEVANCE score should increase as the answer provides RELEVANT context to more parts of the question.
-                                            - Answer that is RELEVANT to some of the question should score of 2, 3, or 4. Higher score indicates more RELEVANCE.
-                                            - Answer that is RELEVANT to most of the question should get a score of 5, 6, 7, or 8. Higher score indicates more RELEVANCE.
-                                            - Answer that is RELEVANT to the entire question should get a score of 9 or 10. Higher score indicates more RELEVANCE.
-                                            - Answer must be relevant and helpful for answering the entire question to get a score of 10.
-                                            - Never elaborate."""
-                        else:
-                            system_prompt = """You are a FACTUAL ACCURACY grader; evaluating the factual correctness of the given answer based on the question and context.  
-                                                Respond only as a number from 0 to 10 where 0 indicates completely factually inaccurate and 10 indicates completely factually accurate.  
-                                                
-                                                A few additional scoring guidelines:  
-                                                - Long answers should score equally well as short answers if they are factually accurate.  
-                                                - The FACTUAL ACCURACY score should increase as the answer contains more factually correct information related to the question and context.  
-                                                - The presence of minor factual inaccuracies should lead to scores of 2, 3, or 4. Higher scores indicate fewer inaccuracies.  
-                                                - If most parts of the answers are factually correct, the score should be 5, 6, 7, or 8. Higher scores indicate greater factual accuracy.  
-                                                - If the entire answer is factually accurate and aligned with the question and context, the score should be 9 or 10.  
-                                                - The answer must strictly avoid fabrications or contradictions to achieve a score of 10.  
-                                                - Never elaborate."""
-
-                        st.text_area(
-                            f"Generated System Prompt for Metric {i + 1}:",
-                            value=system_prompt,
-                            height=200
-                        )
-                    else:
-                        system_prompt = st.text_area(
-                            f"Enter the System Prompt for Metric {i + 1}:",
-                            height=200
+                judge = st.text_input(
+                    f"Judge model for Metric {i + 1}:",
+                    value=DEFAULT_MODELS[mode],
+                    key=f"judge_{i}",
+                    help="An OpenAI model, or provider:model for Groq, a local server or the offline mock, "
+                         "e.g. groq:llama-3.1-8b-instant, local:llama3.1 or mock:judge."
+                )
+
+                cascade = st.checkbox(
+                    f"Score Metric {i + 1} with a fast model first",
+                    key=f"cascade_{i}",
+                    help="Every row gets a cheap score-only grade; only rows near the pass threshold and a "
+                         "spot-check sample get the judge's full grade."
+                )
+
+                metric = {
+                    "name": f"Metric {i + 1}",
+                    "columns": selected_columns,
+                    "system_prompt": system_prompt,
+                    "judge": judge.strip() or None,
+                    "context_budget": context_budget,
+                    "cascade": cascade_settings(cascade and {
+                        "threshold": pass_threshold, "margin": cascade_margin, "sample_rate": cascade_sample_rate
+                    })
+                }
+                metrics.append(metric)
+
+                run_metric = st.button(f"Metric {i + 1} Results", key=f"generate_results_{i}")
+                submit_metric = st.button(f"Submit Metric {i + 1} as Batch Job", key=f"submit_batch_{i}")
+
+                if run_metric or submit_metric:
+                    if system_prompt.strip() == "":
+                        st.error("Please enter a valid system prompt.")
+                    elif submit_metric:
+                        run_log.start(run_id, uploaded_file.name)
+                        rows = sheet.rows(needed_columns(mode, [metric]))
+                        job = submit_evaluation(
+                            rows, mode, metric, run_log, run_id, f"{uploaded_file.name} - Metric {i + 1}",
+                            structured=structured_output, sheet_digest=sheet_digest
                         )
-
-                    if st.button(f"Metric {i + 1} Results", key=f"generate_results_{i}"):
-                        column_mapping = {
-                            "Question": "question",
-                            "Context": "context",
-                            "Answer": "answer",
-                            "Reference Context": "reference_context",
-                            "Reference Answer": "reference_answer"
-                        }
-                        results = []
-                        for index, row in df.iterrows():
-                            params = {"system_prompt": system_prompt}
-                            for col in selected_columns:
-                                if col in column_mapping:
-                                    params[column_mapping[col]] = row[col]
-
-                            try:
-                                # Constructing the evaluation prompt with system prompt and column values
-                                                                # Constructing the evaluation prompt with system prompt and column values
-                                evaluation_prompt = f"""
-                                {system_prompt}
-
-                                Below is the data for evaluation:
-                                {''.join([f'{col}: {row[col]}\n' for col in selected_columns])}
-
-                                Based on the provided data, evaluate the following in this exact format:
-                                1. Criteria: [Provide a detailed explanation of how the evaluation is derived.]
-                                2. Supporting Evidence: [Provide specific examples from the data supporting the evaluation.]
-                                3. Score: [Provide a numerical or qualitative score.]
-
-                                Ensure the response strictly follows this format with numbered headings.
-                                """
-
-                                response = openai.chat.completions.create(
-                                    model="gpt-4o",
-                                    messages=[
-                                        {"role": "system", "content": "You are an evaluator analyzing the provided data."},
-                                        {"role": "user", "content": evaluation_prompt}
-                                    ]
-                                )
-                                response_content = response.choices[0].message.content.strip()
-                                st.write(response_content)
-
-                                # Parsing the GPT response for Criteria, Supporting Evidence, and Score
-                                criteria_match = re.search(r"1\.\s*Criteria:\s*(.*?)(?=\n2\.)", response_content, re.S)
-                                evidence_match = re.search(r"2\.\s*Supporting Evidence:\s*(.*?)(?=\n3\.)", response_content, re.S)
-                                score_match = re.search(r"3\.\s*Score:\s*(.*)", response_content)
-
-                                criteria = criteria_match.group(1).strip() if criteria_match else "Not available"
-                                evidence = evidence_match.group(1).strip() if evidence_match else "Not available"
-                                score = score_match.group(1).strip() if score_match else "Not available"
-
-
-
-                                result_row = {
-                                    "Index": row["Index"],
-                                    "Metric": f"Metric {i + 1}",
-                                    "Selected Columns": ", ".join(selected_columns),
-                                    "Score": score,
-                                    "Criteria": criteria,
-                                    "Supporting Evidence": evidence,
-                                    "Question": row["Question"],
-                                    "Context": row["Context"],
-                                    "Answer": row["Answer"],
-                                    "Reference Context": row["Reference Context"],
-                                    "Reference Answer": row["Reference Answer"]
-                                }
-                                results.append(result_row)
-                            except Exception as e:
-                                results.append({
-                                    "Index": row["Index"],
-                                    "Metric": f"Metric {i + 1}",
-                                    "Selected Columns": ", ".join(selected_columns),
-                                    "Score": "Error",
-                                    "Criteria": "Error",
-                                    "Supporting Evidence": "Error",
-                                    "Question": row["Question"],
-                                    "Context": row["Context"],
-                                    "Answer": row["Answer"],
-                                    "Reference Context": row["Reference Context"],
-                                    "Reference Answer": row["Reference Answer"],
-                                    "Error": str(e)
-                                })
-
-                        st.session_state.combined_results.extend(results)
-                        st.write(f"Results for Metric {i + 1}:")
-                        st.dataframe(pd.DataFrame(results))
-
-                if num_metrics > 1 and st.button("Overall Results"):
-                    if st.session_state.combined_results:
-                        st.write("Combined Results:")
-                        st.dataframe(pd.DataFrame(st.session_state.combined_results))
+                        st.success(f"Submitted batch job {job['job_id']}. Collect its results under Batch Jobs once it completes.")
                     else:
-                        st.warning("No results to combine. Please generate results for individual metrics first.")
-
-        #elif "Conversation" in df.columns and "Agent Prompt" in df.columns:
-        # Agentic Testing (Code 2 processing with updates for lengthy prompts)
-        elif "Conversation" in df.columns and "Agent Prompt" in df.columns:
-            # Code 2 processing
-            required_columns = ["Index", "Conversation", "Agent Prompt"]
-            if not all(col in df.columns for col in required_columns):
-                st.error(f"The uploaded file must contain these columns: {', '.join(required_columns)}.")
-            else:
-                st.write("Preview of Uploaded Data:")
-                st.dataframe(df.head())
-                
-                MAX_PROMPT_LENGTH = 2000  # Define maximum allowable characters for the system prompt
-                
-                def truncate_prompt(prompt: str, max_length: int = MAX_PROMPT_LENGTH) -> str:
-                    """
-                    Truncate the prompt to fit within the allowed maximum length.
-                    """
-                    if len(prompt) > max_length:
-                        return prompt[:max_length] + "..."
-                    return prompt
-                
-                # Define function to evaluate conversation using GPT-4
-                def evaluate_conversation(system_prompt: str, selected_columns: list, conversation: pd.DataFrame, metric_name: str) -> list:
-                    """
-                    Evaluate the conversation using GPT-4 based on the system prompt provided by the user.
-                    """
-                    results = []
-                    
-                    # Truncate the system prompt if it's too long
-                    if len(system_prompt) > MAX_PROMPT_LENGTH:
-                        st.warning(f"The system prompt exceeds {MAX_PROMPT_LENGTH} characters and will be truncated.")
-                        system_prompt = truncate_prompt(system_prompt)
-                    
-                    for index, row in conversation.iterrows():
-                        try:
-                            # Construct the evaluation prompt for GPT-4
-                            evaluation_prompt = f"""
-                            System Prompt: {system_prompt}
-                
-                            Index: {row['Index']}
-                            Conversation: {row['Conversation']}
-                            Agent Prompt: {row['Agent Prompt']}
-                
-                            Evaluate the entire conversation for Agent-Goal Accuracy. Use the following format:
-                            
-                            Criteria: [Explain how well the Agent responded to the User's input and fulfilled their goals]
-                            Supporting Evidence: [Highlight specific faulty or insufficient responses from the Agent]
-                            Score: [Provide a numerical or qualitative score here]
-                            """
-                
-                            # Call GPT-4 API
-                            completion = openai.chat.completions.create(
-                                model="gpt-4",
-                                messages=[
-                                    {"role": "system", "content": "You are an evaluator analyzing agent conversations."},
-                                    {"role": "user", "content": evaluation_prompt}
-                                ]
+                        if mode == "agentic" and count_tokens(system_prompt) > MAX_SYSTEM_PROMPT_TOKENS:
+                            st.warning(f"The system prompt exceeds {MAX_SYSTEM_PROMPT_TOKENS} tokens and will be truncated.")
+
+                        run_log.start(run_id, uploaded_file.name)
+                        fingerprints = grading_fingerprints(sheet_digest, [metric], structured_output)
+                        with st.spinner("Evaluating. Please wait..."):
+                            stats = RunStats()
+                            rows = sheet.rows(needed_columns(mode, [metric]))
+                            results = iter_metric_results(
+                                rows, mode, metric, run_log.done(run_id, fingerprints), structured_output, stats,
+                                **grading
+                            )
+                            show_live(
+                                run_log.record(run_id, results, fingerprints),
+                                f"Results for Metric {i + 1}:",
+                                lambda: run_log.store(run_id, metric["name"]).to_frame(),
+                                stats
                             )
-                
-                            response_content = completion.choices[0].message.content.strip()
-                
-                            # Parse GPT-4 response into structured format
-                            parsed_response = {
-                                "Index": row["Index"],
-                                "Metric": metric_name,
-                                "Selected Columns": ", ".join(selected_columns),
-                                "Score": "",
-                                "Criteria": "",
-                                "Supporting Evidence": "",
-                                "Agent Prompt": row.get("Agent Prompt", ""),
-                                "Conversation": row.get("Conversation", "")
-                            }
-                
-                            # Extract values for Criteria, Supporting Evidence, and Score
-                            for line in response_content.split("\n"):
-                                line = line.strip()
-                                if line.startswith("Criteria:"):
-                                    parsed_response["Criteria"] = line.replace("Criteria:", "").strip()
-                                elif line.startswith("Supporting Evidence:"):
-                                    parsed_response["Supporting Evidence"] = line.replace("Supporting Evidence:", "").strip()
-                                elif line.startswith("Score:"):
-                                    parsed_response["Score"] = line.replace("Score:", "").strip()
-                
-                            # Validate extracted structure
-                            if not (parsed_response["Criteria"] and parsed_response["Supporting Evidence"] and parsed_response["Score"]):
-                                raise ValueError("Response does not contain the required structured fields.")
-                
-                            results.append(parsed_response)
-                
-                        except Exception as e:
-                            results.append({
-                                "Index": row["Index"],
-                                "Metric": metric_name,
-                                "Selected Columns": ", ".join(selected_columns),
-                                "Score": "N/A",
-                                "Criteria": "Error",
-                                "Supporting Evidence": f"Error processing conversation: {e}",
-                                "Agent Prompt": row.get("Agent Prompt", ""),
-                                "Conversation": row.get("Conversation", "")
-                            })
-                
-                    return results
-
-                num_metrics = st.number_input("Enter the number of metrics you want to define:", min_value=1, step=1)
-        
-                if "system_prompts" not in st.session_state:
-                    st.session_state.system_prompts = {}
-                if "combined_results" not in st.session_state:
-                    st.session_state.combined_results = []
-
-                for i in range(num_metrics):
-                    st.markdown(f"""
-                        <hr style="border: 5px solid #000000;">
-                        <h3 style="background-color: #f0f0f0; padding: 10px; border: 2px solid #000000;">
-                            Metric {i + 1}
-                        </h3>
-                    """, unsafe_allow_html=True)
-
-                    # Column selection remains unchanged
-                    selected_columns = st.multiselect(
-                        f"Select columns for Metric {i + 1}:",
-                        options=required_columns[1:],  # Skip the Index column
-                        key=f"columns_{i}"
-                    )
 
-                    toggle_prompt = st.checkbox(
-                        f"Automatically generate system prompt for Metric {i + 1}", key=f"toggle_prompt_{i}"
+            if fuse_metrics and st.button("Evaluate All Metrics"):
+                run_log.start(run_id, uploaded_file.name)
+                metric_names = [metric["name"] for metric in metrics]
+                fingerprints = grading_fingerprints(sheet_digest, metrics, structured_output, fused=True)
+                with st.spinner("Evaluating. Please wait..."):
+                    stats = RunStats()
+                    rows = sheet.rows(needed_columns(mode, metrics))
+                    results = iter_fused_results(
+                        rows, metrics, run_log.done(run_id, fingerprints), structured_output, stats, **grading
+                    )
+                    show_live(
+                        run_log.record(run_id, results, fingerprints),
+                        "Results for All Metrics:",
+                        lambda: run_log.store(run_id).to_frame().loc[lambda frame: frame["Metric"].isin(metric_names)],
+                        stats
                     )
 
+            # Combine results for all metrics
+            if num_metrics > 1 and st.button("Overall Results"):
+                store = run_log.store(run_id)
+                if len(store):
+                    st.write("Combined Results:")
+                    st.dataframe(store.to_frame())
+                    st.write("Summary by Metric:")
+                    st.dataframe(store.aggregate(pass_threshold))
+                    st.bar_chart(store.distribution().T)
+                    st.download_button(
+                        "Download results (Parquet)",
+                        data=store.to_frame().to_parquet(index=False),
+                        file_name=f"{run_id}.parquet",
+                        mime="application/octet-stream"
+                    )
+                else:
+                    st.warning("No results to combine. Please generate results for individual metrics first.")
 
-
-                    if toggle_prompt:
-               
-                      system_prompt = """Role: You are responsible for evaluating the AGENT-GOAL ACCURACY of a conversation based on its alignment with the AGENT PROMPT.  
-
-                                        Scoring Scale (0-10):  
-                                        0 indicates the responses are entirely unrelated to the AGENT PROMPT.  
-                                        1 to 4 reflects limited alignment, lacking depth, precision, or relevance. Scores of 1 to 2 represent negligible coverage with minimal helpfulness, while 3 to 4 indicate partial coverage with insufficient detail or completeness.  
-                                        5 to 8 represents reasonable alignment with clear and relevant responses. Scores of 5 to 6 cover most of the prompt but have significant gaps, while 7 to 8 reflect strong alignment with minor omissions or gaps.  
-                                        9 to 10 signifies comprehensive alignment with precise, complete, and entirely relevant responses. A score of 9 is near-perfect with minimal imperfections, and a score of 10 is fully sufficient and flawlessly aligned.  
-                                        
-                                        Criteria for evaluation include how well the agent responses address user inputs and the AGENT PROMPT, the accuracy, relevance, and helpfulness of the responses, and the completeness and precision in meeting the context of the AGENT PROMPT.  
-                                        
-                                        Supporting evidence should highlight areas of strong alignment and fulfillment of goals while identifying specific faults, such as misunderstanding, inaccuracy, or incompleteness, that detract from the relevance or helpfulness of the responses.  
-                                        
-                                        Output must be a single numerical score between 0 and 10 with no additional text.
-                                        """
-        
-
-                      st.text_area(
-                        f"Generated System Prompt for Metric {i + 1}:", value=system_prompt, height=200
-                        )
-                      st.success(f"System Prompt for Metric {i + 1} is Generated")
-
-                    else:
-                        system_prompt = st.text_area(
-                            f"Enter the System Prompt for Metric {i + 1}:",
-                            height=200
-                        )
-                    
-
-                    # Generate results for each metric
-                    if st.button(f"Metric {i + 1} Results", key=f"generate_results_{i}"):
-                        if system_prompt.strip() == "":
-                            st.error("Please enter a valid system prompt.")
-                        else:
-                            st.write("Evaluating conversations. Please wait...")
-
-                            results = evaluate_conversation(system_prompt, selected_columns, df, f"Metric {i + 1}")
-                            st.session_state.combined_results.extend(results)
-                            st.write(f"Results for Metric {i + 1}:")
-                            st.dataframe(pd.DataFrame(results))
-
-                # Combine results for all metrics
-                # Check if there are combined results before displaying them
-                if num_metrics > 1 and st.button("Overall Results"):
-                    try:
-                        if st.session_state.combined_results:
-                            st.write("Combined Results:")
-                            st.dataframe(pd.DataFrame(st.session_state.combined_results))
-                        else:
-                            st.warning("No results to combine. Please generate results for individual metrics first.")
-                    except Exception as e:
-                        st.error(f"Error displaying combined results: {e}")
-
-
-    
     except Exception as e:
         st.error(f"Error processing the uploaded file: {e}")
+
+# Batch jobs are listed without an upload so results can be collected from a later session
+batch_jobs = list_jobs()
+if batch_jobs:
+    st.markdown("""<hr style="border: 5px solid #000000;">""", unsafe_allow_html=True)
+    st.header("Batch Jobs")
+    for job in batch_jobs:
+        counts = job["request_counts"]
+        with st.expander(f"{job['description'] or job['job_id']} ({job['status']})"):
+            st.write(f"Batch IDs: {', '.join(batch['batch_id'] for batch in job['batches'])}")
+            if job["status"] not in TERMINAL_STATUSES and st.button("Refresh status", key=f"refresh_{job['job_id']}"):
+                try:
+                    job = refresh_job(job)
+                    counts = job["request_counts"]
+                except Exception as e:
+                    st.error(f"Error checking batch job {job['job_id']}: {e}")
+            st.write(f"Status: {job['status']} - {counts['completed']} completed, {counts['failed']} failed of {counts['total']} requests")
+            if job["status"] in TERMINAL_STATUSES and st.button("Load results", key=f"load_{job['job_id']}"):
+                try:
+                    # Into the current upload's or resumed run, else a run of its own; the rows' text was
+                    # logged under the run the job was submitted from
+                    batch_run_id = run_log.start(run_id, job["description"])
+                    rows = run_log.row_data(job["run_id"])
+                    results = list(run_log.record(
+                        batch_run_id, result_rows(job, fetch_results(job), rows), job_fingerprints(job)
+                    ))
+                    st.caption(f"Logged under run {batch_run_id}")
+                    st.dataframe(pd.DataFrame(results))
+                except Exception as e:
+                    st.error(f"Error loading results for batch job {job['job_id']}: {e}")
+
+if response_cache is not None:
+    with cache_stats_placeholder.container():
+        st.subheader("Response Cache")
+        if st.button("Clear response cache"):
+            response_cache.clear()
+        cache_stats = response_cache.stats()
+        hits_column, misses_column = st.columns(2)
+        hits_column.metric("Hits", cache_stats["hits"])
+        misses_column.metric("Misses", cache_stats["misses"])
+        st.caption(f"{cache_stats['entries']} cached responses, {cache_stats['bytes'] / (1024 * 1024):.1f} MB on disk")
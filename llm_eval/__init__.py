@@ -0,0 +1 @@
+"""Evaluation helpers shared by the Streamlit app."""
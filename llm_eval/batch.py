@@ -0,0 +1,265 @@
+"""
+Submission of evaluations through the OpenAI Batch API.
+
+The requests built by either evaluation path are written to JSONL batch
+files, uploaded and submitted, split into as many batches as the API's
+per-batch limits need. Job state is saved under `.llm_eval/batches/` so
+results can be collected from a later session once every batch has
+finished. A job keeps only the Index of each row it grades; the rows' text
+is logged in the run log at submission and joined back from there.
+"""
+import json
+import os
+import time
+
+import openai
+from openai.types.chat import ChatCompletion
+
+from llm_eval.evaluate import build_requests, result_row, row_data
+from llm_eval.providers import DEFAULT_PROVIDER, split_judge
+from llm_eval.runlog import grading_fingerprints
+
+DEFAULT_JOBS_DIR = os.path.join(".llm_eval", "batches")
+BATCH_ENDPOINT = "/v1/chat/completions"
+TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+# Most requests and input file bytes the Batch API takes in one batch
+MAX_BATCH_REQUESTS = 50_000
+MAX_BATCH_BYTES = 200 * 1024 * 1024
+
+
+def batch_line(position: int, request: dict) -> str:
+    """
+    One batch input line; the custom_id is the request's position in the whole job.
+    """
+    line = {"custom_id": f"row-{position}", "method": "POST", "url": BATCH_ENDPOINT, "body": request}
+    return json.dumps(line, ensure_ascii=False, default=_json_value) + "\n"
+
+
+def write_batch_files(requests: list, path: str) -> list:
+    """
+    Write the batch input lines to as many files as the per-batch limits need; returns their paths.
+
+    The files are `path` with the part number appended before the extension.
+    """
+    stem, extension = os.path.splitext(path)
+    paths, batch_file = [], None
+    count = size = 0
+    try:
+        for position, request in enumerate(requests):
+            line = batch_line(position, request).encode("utf-8")
+            if batch_file is None or count == MAX_BATCH_REQUESTS or size + len(line) > MAX_BATCH_BYTES:
+                if batch_file is not None:
+                    batch_file.close()
+                paths.append(f"{stem}-{len(paths)}{extension}")
+                batch_file = open(paths[-1], "wb")
+                count = size = 0
+            batch_file.write(line)
+            count += 1
+            size += len(line)
+    finally:
+        if batch_file is not None:
+            batch_file.close()
+    return paths
+
+
+def _json_value(value):
+    # numpy scalars from DataFrame rows
+    return value.item() if hasattr(value, "item") else str(value)
+
+
+def save_job(job: dict, jobs_dir: str = DEFAULT_JOBS_DIR):
+    os.makedirs(jobs_dir, exist_ok=True)
+    path = os.path.join(jobs_dir, f"{job['job_id']}.json")
+    with open(path + ".tmp", "w", encoding="utf-8") as job_file:
+        json.dump(job, job_file, ensure_ascii=False, default=_json_value)
+    os.replace(path + ".tmp", path)
+
+
+def list_jobs(jobs_dir: str = DEFAULT_JOBS_DIR) -> list:
+    """
+    Load every saved job, newest first.
+    """
+    if not os.path.isdir(jobs_dir):
+        return []
+    jobs = []
+    for name in os.listdir(jobs_dir):
+        if name.endswith(".json"):
+            with open(os.path.join(jobs_dir, name), encoding="utf-8") as job_file:
+                jobs.append(json.load(job_file))
+    return sorted(jobs, key=lambda job: job["created_at"], reverse=True)
+
+
+def job_status(batches: list) -> str:
+    """
+    A job's status: that of a batch still running, else "completed" unless a batch ended otherwise.
+    """
+    statuses = [batch["status"] for batch in batches]
+    unfinished = [status for status in statuses if status not in TERMINAL_STATUSES]
+    if unfinished:
+        return unfinished[0]
+    return next((status for status in statuses if status != "completed"), "completed")
+
+
+def _request_counts(batches: list) -> dict:
+    return {key: sum(batch["request_counts"][key] for batch in batches) for key in ("total", "completed", "failed")}
+
+
+def submit_batch(requests: list, indexes: list, mode: str, metric: dict, run_id: str, description: str = "",
+                 client=None, jobs_dir: str = DEFAULT_JOBS_DIR, parts: list = None, structured: bool = False,
+                 sheet_digest: str = None) -> dict:
+    """
+    Upload `requests` as one or more batches and save them as one job.
+
+    `indexes` holds the Index of each row the requests grade, whose text is
+    logged under `run_id`, and `parts` how many consecutive requests each
+    row has (one each by default); `mode`, `metric` and `structured` are
+    kept so `result_rows` can parse the results as an interactive run would,
+    and with `sheet_digest` so they are logged under the same fingerprints.
+    If a batch cannot be submitted, the ones already submitted are cancelled.
+    """
+    client = client or openai.OpenAI(api_key=openai.api_key)
+    os.makedirs(jobs_dir, exist_ok=True)
+    input_paths = write_batch_files(requests, os.path.join(jobs_dir, f"input-{int(time.time() * 1000)}.jsonl"))
+    if not input_paths:
+        raise ValueError("There are no requests to submit.")
+    options = {"metadata": {"description": description[:500]}} if description else {}
+    batches = []
+    try:
+        for input_path in input_paths:
+            with open(input_path, "rb") as batch_file:
+                input_file = client.files.create(file=batch_file, purpose="batch")
+            batch = client.batches.create(
+                input_file_id=input_file.id,
+                endpoint=BATCH_ENDPOINT,
+                completion_window="24h",
+                **options,
+            )
+            batches.append({
+                "batch_id": batch.id,
+                "input_file_id": input_file.id,
+                "output_file_id": None,
+                "error_file_id": None,
+                "status": batch.status,
+                "request_counts": {"total": 0, "completed": 0, "failed": 0},
+            })
+    except Exception:
+        for batch in batches:
+            client.batches.cancel(batch["batch_id"])
+        raise
+    finally:
+        for input_path in input_paths:
+            os.remove(input_path)
+
+    job = {
+        "job_id": batches[0]["batch_id"],
+        "batches": batches,
+        "status": job_status(batches),
+        "mode": mode,
+        "metric": metric,
+        "description": description,
+        "created_at": time.time(),
+        "request_counts": {"total": len(requests), "completed": 0, "failed": 0},
+        "run_id": run_id,
+        "indexes": indexes,
+        "parts": parts or [1] * len(indexes),
+        "structured": structured,
+        "sheet_digest": sheet_digest,
+    }
+    save_job(job, jobs_dir)
+    return job
+
+
+def refresh_job(job: dict, client=None, jobs_dir: str = DEFAULT_JOBS_DIR) -> dict:
+    """
+    Poll the job's unfinished batches once and save their latest status.
+    """
+    client = client or openai.OpenAI(api_key=openai.api_key)
+    for part in job["batches"]:
+        if part["status"] in TERMINAL_STATUSES:
+            continue
+        batch = client.batches.retrieve(part["batch_id"])
+        part["status"] = batch.status
+        part["output_file_id"] = batch.output_file_id
+        part["error_file_id"] = batch.error_file_id
+        if batch.request_counts is not None:
+            part["request_counts"] = batch.request_counts.model_dump()
+    job["status"] = job_status(job["batches"])
+    job["request_counts"] = _request_counts(job["batches"])
+    save_job(job, jobs_dir)
+    return job
+
+
+def fetch_results(job: dict, client=None) -> list:
+    """
+    Download the output of a finished job's batches, in request order.
+
+    Each entry is a ChatCompletion, or an exception for requests that failed
+    or are missing from the output (e.g. when a batch expired).
+    """
+    client = client or openai.OpenAI(api_key=openai.api_key)
+    results = [RuntimeError(f"No result returned by batch job {job['job_id']} ({job['status']}).")] * sum(job["parts"])
+    for part in job["batches"]:
+        for file_id in (part["output_file_id"], part["error_file_id"]):
+            if not file_id:
+                continue
+            for line in client.files.content(file_id).text.splitlines():
+                if not line.strip():
+                    continue
+                output = json.loads(line)
+                position = int(output["custom_id"].removeprefix("row-"))
+                response = output.get("response") or {}
+                if response.get("status_code") == 200:
+                    results[position] = ChatCompletion.model_validate(response["body"])
+                else:
+                    error = output.get("error") or (response.get("body") or {}).get("error") or {}
+                    results[position] = RuntimeError(error.get("message", f"Batch request failed: {line}"))
+    return results
+
+
+def submit_evaluation(rows, mode: str, metric: dict, run_log, run_id: str, description: str = "", client=None,
+                      jobs_dir: str = DEFAULT_JOBS_DIR, structured: bool = False, sheet_digest: str = None) -> dict:
+    """
+    Submit the requests grading each of `rows` on `metric` as one batch job.
+
+    The rows' text is logged in `run_log` under `run_id`, where
+    `result_rows` finds it, and `sheet_digest` is kept for `job_fingerprints`.
+    Batches go to the OpenAI Batch API, so the metric's judge must be an
+    OpenAI model.
+    """
+    if metric.get("judge") and split_judge(metric["judge"])[0] != DEFAULT_PROVIDER:
+        raise ValueError(f"Batch jobs need an OpenAI judge; {metric['name']} is graded by {metric['judge']}.")
+    rows = [{"Index": row["Index"], **row_data(mode, row)} for row in rows]
+    run_log.add_rows(run_id, rows)
+    requests, indexes, parts = [], [], []
+    for row in rows:
+        row_requests = build_requests(mode, row, metric, structured)
+        requests.extend({**request, "model": split_judge(request["model"])[1]} for request in row_requests)
+        indexes.append(row["Index"])
+        parts.append(len(row_requests))
+    return submit_batch(requests, indexes, mode, metric, run_id, description, client, jobs_dir, parts, structured,
+                        sheet_digest)
+
+
+def result_rows(job: dict, results: list, rows: dict) -> list:
+    """
+    Join batch results back to their rows, parsed as in an interactive run.
+
+    `rows` maps each Index, as a string, to its row (see
+    `RunLog.row_data`). Malformed replies are not repaired here; their
+    Parse Status is "failed".
+    """
+    graded, start = [], 0
+    for index, count in zip(job["indexes"], job["parts"]):
+        if str(index) not in rows:
+            raise ValueError(f"Row {index} of batch job {job['job_id']} is not in run {job['run_id']}.")
+        graded.append(result_row(job["mode"], rows[str(index)], job["metric"], results[start:start + count],
+                                 structured=job["structured"]))
+        start += count
+    return graded
+
+
+def job_fingerprints(job: dict) -> dict:
+    """
+    The fingerprints to log a job's results under, as an interactive run of its sheet and metric would.
+    """
+    return grading_fingerprints(job["sheet_digest"], [job["metric"]], job["structured"])
@@ -0,0 +1,152 @@
+"""
+Throughput benchmark of both evaluation paths against the mock judge:
+
+    python -m llm_eval.benchmark --rows 1000 10000 100000 --paths rag agentic --latency 0.05
+
+Synthetic sheets of each size are written to a temporary directory and
+graded on one metric by `mock:judge`, which answers in process after
+`--latency` seconds, without the response cache and with rate limits far
+above what the run can use. Each case runs in its own process, so the
+peak RSS reported is that case's alone. Reports rows/s, p50/p95/p99 call
+latency, tokens/s, peak RSS and the seconds spent in each stage (see
+`timing`). With `--cascade` the metric is cascaded (see `cascade`), and the
+share of full-grade calls saved is reported too, with the net change in
+calls and prompt tokens once the cheap calls are counted.
+"""
+import argparse
+import csv
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from llm_eval.config import resolve_metrics
+from llm_eval.evaluate import iter_results
+from llm_eval.loading import REQUIRED_COLUMNS, Sheet
+from llm_eval.providers import JudgeClients, mock_client
+from llm_eval.timing import RunStats
+
+DEFAULT_ROWS = [1000, 10000, 100000]
+DEFAULT_LATENCY = 0.05
+DEFAULT_CONCURRENCY = 64
+# Far above any run's needs, so the mock judge's latency is the only wait
+UNLIMITED_RPM = 10 ** 9
+UNLIMITED_TPM = 10 ** 12
+TURNS_PER_CONVERSATION = 6
+
+
+def synthetic_row(mode: str, index: int) -> list:
+    """
+    One row of a synthetic sheet, in the column order of REQUIRED_COLUMNS[mode].
+    """
+    if mode == "agentic":
+        conversation = "\n".join(
+            f"User: Can you help me with order {index}-{turn}?\nAgent: Certainly, order {index}-{turn} ships tomorrow."
+            for turn in range(TURNS_PER_CONVERSATION)
+        )
+        return [index, conversation, "You are a support agent. Answer order questions politely and accurately."]
+    return [
+        index,
+        f"When was landmark {index} built?",
+        f"Landmark {index} was built in {1800 + index % 200} and restored a century later. " * 3,
+        f"Landmark {index} was built in {1800 + index % 200}.",
+        f"Landmark {index} was completed in {1800 + index % 200}.",
+        f"It was built in {1800 + index % 200}.",
+    ]
+
+
+def write_sheet(path: str, mode: str, rows: int):
+    """
+    Write a synthetic .csv sheet of `rows` rows for the `mode` evaluation path.
+    """
+    with open(path, "w", encoding="utf-8", newline="") as sheet:
+        writer = csv.writer(sheet)
+        writer.writerow(REQUIRED_COLUMNS[mode])
+        writer.writerows(synthetic_row(mode, index) for index in range(1, rows + 1))
+
+
+def peak_rss_mb():
+    """
+    Peak resident memory of this process in MB, or None where it cannot be read.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS and in kilobytes elsewhere
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def run_case(path: str, mode: str, latency: float, concurrency: int, cascade: bool = False) -> dict:
+    """
+    Grade the sheet at `path` with the mock judge, returning the run's timing summary and peak RSS.
+    """
+    metrics = resolve_metrics([{"name": "Benchmark", "judge": "mock:judge", "cascade": cascade}], mode)
+    clients = JudgeClients({"mock": mock_client(latency)})
+    stats = RunStats()
+    results = iter_results(Sheet(path), mode, metrics, stats=stats, clients=clients, concurrency=concurrency,
+                           rpm=UNLIMITED_RPM, tpm=UNLIMITED_TPM)
+    errors = sum(result["Criteria"] == "Error" for result in results)
+    return {**stats.summary(), "errors": errors, "peak_rss_mb": peak_rss_mb()}
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m llm_eval.benchmark", description="Benchmark both evaluation paths against the mock judge.")
+    parser.add_argument("--rows", type=int, nargs="+", default=DEFAULT_ROWS, help="Sheet sizes to run")
+    parser.add_argument("--paths", nargs="+", choices=sorted(REQUIRED_COLUMNS), default=sorted(REQUIRED_COLUMNS),
+                        help="Evaluation paths to run")
+    parser.add_argument("--latency", type=float, default=DEFAULT_LATENCY, help="Mock judge latency in seconds")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="Concurrent requests")
+    parser.add_argument("--cascade", action="store_true", help="Score rows with a cheap score-only pass first")
+    parser.add_argument("--json", action="store_true", help="Print one JSON object per case instead of a table")
+    # Set when the benchmark runs one case in a child process
+    parser.add_argument("--case", nargs=2, metavar=("MODE", "SHEET"), help=argparse.SUPPRESS)
+    return parser
+
+
+def main(argv: list = None) -> int:
+    args = build_parser().parse_args(argv)
+    if args.case:
+        mode, path = args.case
+        print(json.dumps(run_case(path, mode, args.latency, args.concurrency, args.cascade)))
+        return 0
+
+    cases = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for mode in args.paths:
+            for rows in args.rows:
+                path = os.path.join(workdir, f"{mode}-{rows}.csv")
+                write_sheet(path, mode, rows)
+                child = subprocess.run(
+                    [sys.executable, "-m", "llm_eval.benchmark", "--case", mode, path,
+                     "--latency", str(args.latency), "--concurrency", str(args.concurrency)]
+                    + (["--cascade"] if args.cascade else []),
+                    capture_output=True, text=True
+                )
+                if child.returncode != 0:
+                    print(child.stderr, file=sys.stderr)
+                    return child.returncode
+                case = {"path": mode, "sheet_rows": rows, **json.loads(child.stdout)}
+                cases.append(case)
+                if args.json:
+                    print(json.dumps(case), flush=True)
+                else:
+                    print(f"{mode} {rows} rows: {case['rows_per_s']} rows/s, p95 {case['p95_ms']} ms", file=sys.stderr)
+
+    if not args.json:
+        table = pd.json_normalize(cases).set_index(["path", "sheet_rows"])
+        table.columns = [col.removeprefix("stages_s.") + (" (s)" if col.startswith("stages_s.") else "") for col in table.columns]
+        with pd.option_context("display.width", 250, "display.max_columns", None):
+            print(table.astype(object).T.to_string())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,146 @@
+"""
+Content-addressed on-disk cache of judge responses.
+
+Entries are keyed on a hash of the whole request (model, messages and
+sampling parameters), so re-running a metric only pays for rows whose
+prompt actually changed. The store is a single SQLite file bounded in size
+by evicting the least recently used entries.
+
+Writes are committed in batches, every COMMIT_EVERY writes or
+COMMIT_INTERVAL seconds and on `flush`, and the store's size is kept as a
+running total, so a put costs one insert. Eviction only runs once the
+total crosses `max_bytes`, and then frees room down to EVICT_TO of it.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from openai.types.chat import ChatCompletion
+
+DEFAULT_CACHE_PATH = os.path.join(".llm_eval", "responses.sqlite")
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+COMMIT_EVERY = 100
+COMMIT_INTERVAL = 1.0
+# Share of `max_bytes` an eviction frees the store down to, so the next puts do not evict again
+EVICT_TO = 0.9
+
+
+def request_key(request: dict) -> str:
+    """
+    Hash a chat completion request into a stable cache key.
+    """
+    canonical = json.dumps(request, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Size-bounded LRU cache of chat completions stored in SQLite.
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        self.total = self._stored_bytes()
+        self.pending = 0
+        self.committed = time.monotonic()
+
+    def _stored_bytes(self) -> int:
+        return self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def _written(self):
+        # Commit once enough writes or time have accumulated
+        self.pending += 1
+        if self.pending >= COMMIT_EVERY or time.monotonic() - self.committed >= COMMIT_INTERVAL:
+            self._commit()
+
+    def _commit(self):
+        self.connection.commit()
+        self.pending = 0
+        self.committed = time.monotonic()
+
+    def flush(self):
+        """
+        Commit the writes not committed yet.
+        """
+        with self.lock:
+            self._commit()
+
+    def get(self, request: dict):
+        """
+        Return the cached completion for `request`, or None on a miss.
+        """
+        key = request_key(request)
+        with self.lock:
+            row = self.connection.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.connection.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._written()
+        return ChatCompletion.model_validate_json(row[0])
+
+    def put(self, request: dict, completion: ChatCompletion):
+        """
+        Store a completion, evicting least recently used entries once the store grows beyond `max_bytes`.
+        """
+        response = completion.model_dump_json()
+        key = request_key(request)
+        with self.lock:
+            replaced = self.connection.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, response, len(response), time.time()),
+            )
+            self.total += len(response) - (replaced[0] if replaced else 0)
+            if self.total > self.max_bytes:
+                self._evict()
+            self._written()
+
+    def _evict(self):
+        # Other processes may share the store, so the running total is only trusted to trigger eviction
+        self.total = self._stored_bytes()
+        target = self.max_bytes * EVICT_TO
+        if self.total <= target:
+            return
+        evicted = []
+        for key, size in self.connection.execute("SELECT key, size FROM responses ORDER BY last_access"):
+            if self.total <= target:
+                break
+            evicted.append((key,))
+            self.total -= size
+        self.connection.executemany("DELETE FROM responses WHERE key = ?", evicted)
+        self._commit()
+
+    def stats(self) -> dict:
+        """
+        Hit/miss counters for this process together with the size of the store.
+        """
+        with self.lock:
+            self._commit()
+            entries, size = self.connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": entries, "bytes": size}
+
+    def clear(self):
+        with self.lock:
+            self.connection.execute("DELETE FROM responses")
+            self._commit()
+            self.total = 0
+        self.hits = 0
+        self.misses = 0
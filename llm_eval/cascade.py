@@ -0,0 +1,77 @@
+"""
+Cascaded grading: a cheap score for every row, the full grade only where it matters.
+
+A metric with a "cascade" first has each row scored by a score-only
+request to a cheap judge: the fast model of its judge's provider unless
+the cascade names one. The row keeps that score, without criteria or
+evidence, unless it is escalated to the metric's full grade because
+
+- the score is within `margin` points of the pass `threshold`, or could
+  not be read, or
+- the row is in the `sample_rate` share of rows spot-checked against the
+  full grade.
+
+The spot checks measure the agreement rate: the share of sampled rows
+whose cheap and full grades fall on the same side of the threshold.
+Conversations too long for a single request skip the cheap pass.
+"""
+import hashlib
+
+from llm_eval.providers import fast_judge
+from llm_eval.results import DEFAULT_PASS_THRESHOLD
+
+DEFAULT_MARGIN = 1.5
+DEFAULT_SAMPLE_RATE = 0.05
+CASCADE_OPTIONS = ("threshold", "margin", "sample_rate", "judge")
+
+# What became of a row's cheap grade
+EXITED = "exited"
+ESCALATED = "escalated"
+SAMPLED = "sampled"
+
+
+def cascade_settings(cascade) -> dict:
+    """
+    Settings for a metric's "cascade" (false, true or a mapping of CASCADE_OPTIONS), or None when it has none.
+    """
+    if not cascade:
+        return None
+    settings = {"threshold": DEFAULT_PASS_THRESHOLD, "margin": DEFAULT_MARGIN, "sample_rate": DEFAULT_SAMPLE_RATE,
+                "judge": None}
+    if isinstance(cascade, dict):
+        unknown = set(cascade) - set(CASCADE_OPTIONS)
+        if unknown:
+            raise ValueError(f"Unknown cascade options: {', '.join(sorted(unknown))}.")
+        settings.update({option: value for option, value in cascade.items() if value is not None})
+    return settings
+
+
+def cheap_judge(metric: dict, default_judge: str) -> str:
+    """
+    The judge of a cascaded metric's score-only pass.
+    """
+    return metric["cascade"]["judge"] or fast_judge(metric.get("judge") or default_judge)
+
+
+def in_sample(metric_name: str, index, sample_rate: float) -> bool:
+    """
+    Whether a row is spot-checked; the draw depends only on the metric and Index, so resumed runs agree.
+    """
+    digest = hashlib.sha256(f"{metric_name}\n{index}".encode()).hexdigest()
+    return int(digest[:8], 16) / 16 ** 8 < sample_rate
+
+
+def route(score: float, settings: dict, sampled: bool) -> str:
+    """
+    EXITED, ESCALATED or SAMPLED for a row whose cheap score is `score` (NaN when unreadable).
+    """
+    if not abs(score - settings["threshold"]) > settings["margin"]:
+        return ESCALATED
+    return SAMPLED if sampled else EXITED
+
+
+def agrees(cheap_score: float, full_score: float, threshold: float) -> bool:
+    """
+    Whether a cheap and a full grade pass or fail the threshold alike.
+    """
+    return (cheap_score >= threshold) == (full_score >= threshold)
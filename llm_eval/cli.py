@@ -0,0 +1,153 @@
+"""
+Headless evaluation of a sheet:
+
+    python -m llm_eval sheet.xlsx --config metrics.yaml --output results.csv
+
+Every result is logged as it is graded under a run ID, printed at the
+start. If a run is interrupted, repeating the command with `--run-id`
+grades only the (Index, Metric) pairs still missing or failed and writes
+the complete results; metrics whose settings or sheet changed since are
+graded again. The OpenAI API key is read from the OPENAI_API_KEY
+environment variable, and other judge providers' settings as described in
+`llm_eval.providers`.
+"""
+import argparse
+import csv
+import json
+import sys
+
+import pandas as pd
+
+from llm_eval.cache import DEFAULT_CACHE_PATH, ResponseCache
+from llm_eval.cascade import cascade_settings
+from llm_eval.config import GRADING_OPTIONS, load_config, resolve_metrics
+from llm_eval.evaluate import iter_results, result_columns
+from llm_eval.loading import Sheet, detect_mode, missing_columns
+from llm_eval.runlog import DEFAULT_RUNLOG_PATH, RunLog, grading_fingerprints
+from llm_eval.timing import RunStats
+
+PROGRESS_EVERY = 1000
+
+
+def write_results(results, path: str, columns: list) -> dict:
+    """
+    Write result rows as .csv, .xlsx, .json or .jsonl, chosen by the extension of `path`.
+
+    CSV and JSON Lines output is written row by row as results arrive; the
+    other formats are built in memory. Returns result and error counts.
+    Parquet output is written from the run's ResultStore instead.
+    """
+    counts = {"results": 0, "errors": 0}
+
+    def counted(results):
+        for result in results:
+            counts["results"] += 1
+            counts["errors"] += result["Criteria"] == "Error"
+            yield result
+
+    if path.endswith(".jsonl"):
+        with open(path, "w", encoding="utf-8") as output:
+            for result in counted(results):
+                output.write(json.dumps(result, ensure_ascii=False, default=str) + "\n")
+    elif path.endswith((".xlsx", ".json")):
+        frame = pd.DataFrame(list(counted(results)))
+        frame = frame[[col for col in columns if col in frame.columns]]
+        if path.endswith(".xlsx"):
+            frame.to_excel(path, index=False)
+        else:
+            frame.to_json(path, orient="records", force_ascii=False, indent=2)
+    else:
+        with open(path, "w", encoding="utf-8", newline="") as output:
+            writer = csv.DictWriter(output, fieldnames=columns, restval="")
+            writer.writeheader()
+            writer.writerows(counted(results))
+    return counts
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m llm_eval", description="Evaluate an LLM output sheet without the Streamlit UI.")
+    parser.add_argument("input", help="Sheet to evaluate (.xlsx or .csv)")
+    parser.add_argument("--config", required=True, help="Metric config (.yaml, .yml or .json)")
+    parser.add_argument("--output", required=True, help="Where to write results (.csv, .xlsx, .json, .jsonl or .parquet)")
+    parser.add_argument("--fused", action="store_true", default=None, help="Score all metrics in one call per row")
+    parser.add_argument("--structured", action="store_true", default=None, help="Ask for JSON grades under a strict schema")
+    parser.add_argument("--concurrency", type=int, help="Concurrent requests")
+    parser.add_argument("--timeout", type=float, help="Request timeout in seconds")
+    parser.add_argument("--rpm", type=int, help="Requests-per-minute budget of each judge model")
+    parser.add_argument("--tpm", type=int, help="Tokens-per-minute budget of each judge model")
+    parser.add_argument("--judge", help="Judge for every metric as provider:model, e.g. groq:llama-3.1-8b-instant or mock:judge")
+    parser.add_argument("--context-budget", type=int, help="Tokens per request for every metric, splitting longer conversations")
+    parser.add_argument("--cascade", action="store_true", help="Score every row with a cheap judge first, grading in full only near the threshold")
+    parser.add_argument("--no-cache", dest="cache", action="store_false", default=None, help="Do not reuse cached responses")
+    parser.add_argument("--run-id", help="Resume this run, skipping results already graded with the same sheet and settings")
+    parser.add_argument("--runlog", default=DEFAULT_RUNLOG_PATH, help="Run log database")
+    return parser
+
+
+def main(argv: list = None) -> int:
+    args = build_parser().parse_args(argv)
+    try:
+        config = load_config(args.config)
+        sheet = Sheet(args.input)
+        columns = sheet.columns
+        mode = detect_mode(columns)
+        if mode is None:
+            raise ValueError("The sheet must have Question/Context/Answer or Conversation/Agent Prompt columns.")
+        if missing_columns(mode, columns):
+            raise ValueError(f"The sheet is missing these columns: {', '.join(missing_columns(mode, columns))}.")
+        fused = config["fused"] if args.fused is None else args.fused
+        if fused and mode != "rag":
+            raise ValueError("Fused evaluation is only available for Question/Context/Answer sheets.")
+        metrics = resolve_metrics(config["metrics"], mode)
+        for metric in metrics:
+            if args.judge is not None:
+                metric["judge"] = args.judge
+            if args.context_budget is not None:
+                metric["context_budget"] = args.context_budget
+            if args.cascade and not metric["cascade"]:
+                metric["cascade"] = cascade_settings(True)
+    except (OSError, ValueError) as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 2
+
+    grading = config["grading"]
+    for option in GRADING_OPTIONS:
+        if getattr(args, option) is not None:
+            grading[option] = getattr(args, option)
+    cache = grading.pop("cache", True)
+    if cache:
+        grading["cache"] = ResponseCache(cache if isinstance(cache, str) else DEFAULT_CACHE_PATH)
+    structured = config["structured"] if args.structured is None else args.structured
+
+    run_log = RunLog(args.runlog)
+    run_id = run_log.start(args.run_id, f"{args.input} ({args.config})")
+    fingerprints = grading_fingerprints(sheet.digest(), metrics, structured, fused)
+    done = run_log.done(run_id, fingerprints)
+    print(f"Run {run_id}: evaluating {args.input} on {len(metrics)} metrics ({mode}), "
+          f"{len(done)} results already logged...", file=sys.stderr)
+    graded = 0
+    stats = RunStats()
+    results = iter_results(sheet, mode, metrics, fused, done, structured, stats, **grading)
+    for result in run_log.record(run_id, results, fingerprints):
+        graded += 1
+        if graded % PROGRESS_EVERY == 0:
+            timing = stats.summary()
+            print(f"{graded} results graded, {timing['rows_per_s']} rows/s, p95 {timing['p95_ms']} ms", file=sys.stderr)
+
+    store = run_log.store(run_id)
+    if args.output.endswith(".parquet"):
+        store.to_parquet(args.output)
+        summary = {"results": len(store), "errors": int(store.grades["Criteria"].eq("Error").sum())}
+    else:
+        summary = write_results(run_log.results(run_id), args.output, result_columns(mode, metrics))
+    summary.update({"run_id": run_id, "graded": graded, "output": args.output})
+    with pd.option_context("display.width", 200, "display.max_columns", None):
+        print(store.aggregate().round(3).to_string(), file=sys.stderr)
+    if cache:
+        summary["cache"] = grading["cache"].stats()
+    summary["timing"] = stats.summary()
+    summary["duplicates"] = summary["timing"].pop("duplicates")
+    if "cascade" in summary["timing"]:
+        summary["cascade"] = summary["timing"].pop("cascade")
+    print(json.dumps(summary), file=sys.stderr)
+    return 0
@@ -0,0 +1,91 @@
+"""
+Metric configuration files for headless runs.
+
+A config is YAML or JSON, either a list of metrics or a mapping such as:
+
+    fused: false
+    structured: false
+    grading:
+      concurrency: 16
+      rpm: 500
+      tpm: 30000
+      cache: true
+    metrics:
+      - name: Relevance
+        columns: [Question, Answer]
+        judge: groq:llama-3.1-8b-instant
+        cascade:
+          margin: 1.5
+          sample_rate: 0.05
+      - name: Factual Accuracy
+        columns: [Question, Context, Answer]
+        system_prompt: You are a FACTUAL ACCURACY grader; ...
+        context_budget: 8192
+
+Metrics without a name are called "Metric N", and metrics without a
+system prompt get the one the app would generate for them. A metric's
+judge is "provider:model" (see `providers`), an OpenAI model by default.
+Its context_budget caps the tokens of each request (the judge model's
+context window by default); longer conversations are graded in windows.
+A cascade (true, or a mapping of threshold, margin, sample_rate and
+judge) scores rows with a cheap judge first; see `cascade`.
+"""
+import json
+
+from llm_eval.cascade import cascade_settings
+from llm_eval.loading import REQUIRED_COLUMNS
+from llm_eval.prompts import default_system_prompt
+
+GRADING_OPTIONS = ("concurrency", "timeout", "rpm", "tpm", "cache")
+
+
+def load_config(path: str) -> dict:
+    """
+    Read a config file into {"metrics": [...], "fused": bool, "structured": bool, "grading": {...}}.
+    """
+    with open(path, encoding="utf-8") as config_file:
+        if path.endswith((".yaml", ".yml")):
+            try:
+                import yaml
+            except ImportError:
+                raise ValueError("PyYAML is required to read YAML configs; install it or use JSON.")
+            config = yaml.safe_load(config_file)
+        else:
+            config = json.load(config_file)
+
+    if isinstance(config, list):
+        config = {"metrics": config}
+    if not isinstance(config, dict) or not config.get("metrics"):
+        raise ValueError(f"{path} must define at least one metric.")
+    unknown = set(config.get("grading") or {}) - set(GRADING_OPTIONS)
+    if unknown:
+        raise ValueError(f"Unknown grading options in {path}: {', '.join(sorted(unknown))}.")
+    return {
+        "metrics": config["metrics"],
+        "fused": bool(config.get("fused")),
+        "structured": bool(config.get("structured")),
+        "grading": dict(config.get("grading") or {})
+    }
+
+
+def resolve_metrics(metrics: list, mode: str) -> list:
+    """
+    Fill in metric names and default system prompts, checking columns against the sheet's evaluation path.
+    """
+    options = REQUIRED_COLUMNS[mode][1:]
+    resolved = []
+    for position, metric in enumerate(metrics):
+        name = metric.get("name") or f"Metric {position + 1}"
+        columns = metric.get("columns") or options
+        unknown = [col for col in columns if col not in options]
+        if unknown:
+            raise ValueError(f"{name} selects unknown columns: {', '.join(unknown)}. Choose from: {', '.join(options)}.")
+        resolved.append({
+            "name": name,
+            "columns": list(columns),
+            "system_prompt": metric.get("system_prompt") or default_system_prompt(mode, position),
+            "judge": metric.get("judge"),
+            "context_budget": metric.get("context_budget"),
+            "cascade": cascade_settings(metric.get("cascade"))
+        })
+    return resolved
@@ -0,0 +1,169 @@
+"""
+Concurrent grading engine shared by both evaluation paths.
+
+Requests are plain keyword dictionaries for `chat.completions.create`, so the
+same request can be sent, cached or written to a batch file unchanged; the
+provider named in a request's model (see `providers`) answers it.
+Requests are consumed lazily and results are produced in input order with
+a bounded number of requests held in memory, so sheets of any size stream
+through at constant memory.
+"""
+import asyncio
+import collections
+import time
+from typing import NamedTuple
+
+from llm_eval.providers import JudgeClients
+from llm_eval.scheduler import DEFAULT_RPM, DEFAULT_TPM, RateLimiter, complete
+
+DEFAULT_CONCURRENCY = 8
+DEFAULT_TIMEOUT = 60.0
+# Finished results held back while an earlier, slower request completes
+WINDOW_PER_WORKER = 4
+
+
+class Repaired(NamedTuple):
+    """
+    A completion whose reply was malformed, with the result of its repair request.
+    """
+    completion: object
+    repair: object
+
+
+class Cached(NamedTuple):
+    """
+    A completion served from the response cache, which sent nothing.
+    """
+    completion: object
+
+
+class Escalated(NamedTuple):
+    """
+    A cheap grade that was escalated, with the results of the full grading requests sent after it.
+    """
+    completion: object
+    results: list
+
+
+async def grade_stream(items, concurrency: int = DEFAULT_CONCURRENCY, timeout: float = DEFAULT_TIMEOUT,
+                       rpm: int = DEFAULT_RPM, tpm: int = DEFAULT_TPM, clients: JudgeClients = None, cache=None,
+                       repair=None, escalate=None, stats=None):
+    """
+    Grade an iterable of (tag, request) pairs, yielding (tag, result) pairs in input order.
+
+    At most `concurrency` calls are in flight, within the `rpm` and `tpm`
+    budgets of each provider and model: every judge gets its own rate
+    limiter, since providers meter their models separately. A request that
+    still fails after its retries yields its exception in place of a
+    completion. With a `cache`, requests answered before are served from
+    it, as Cached completions, and only misses are sent. `clients` routes
+    requests to their providers; without it, clients are created as needed.
+
+    `repair(request, completion)` may return a follow-up request for a
+    completion it cannot parse; that request is sent once, under the same
+    budgets, and a Repaired pair is yielded in place of the completion.
+
+    `escalate(tag, result)` may return the requests of a fuller grade for a
+    cheap grade's result (a completion or an exception); they are sent
+    together, each with its repair, and an Escalated pair is yielded in
+    place of the result. An item whose request is None is not sent: its
+    result is None, or with `escalate`, whatever escalating a missing cheap
+    grade gives. A request may also be an async function called without
+    arguments, when the item's turn comes, that returns the request to send
+    or None; it can wait on an earlier item's result without holding up
+    the stream.
+
+    Each call's latency and token usage are recorded in `stats`, a
+    `timing.RunStats`, when given.
+    """
+    limiters = {}
+    semaphore = asyncio.Semaphore(concurrency)
+    window = collections.deque()
+    owns_clients = clients is None
+    if owns_clients:
+        clients = JudgeClients()
+
+    async def send(request: dict):
+        cached = cache.get(request) if cache is not None else None
+        if cached is not None:
+            return Cached(cached)
+        async with semaphore:
+            try:
+                client, routed = clients.route(request)
+                # The request's model names both the provider and its model
+                limiter = limiters.get(request["model"])
+                if limiter is None:
+                    limiter = limiters[request["model"]] = RateLimiter(rpm, tpm)
+                sent = time.perf_counter()
+                completion = await complete(client, routed, limiter, timeout)
+            except Exception as e:
+                return e
+        if stats is not None:
+            stats.call(time.perf_counter() - sent, completion.usage)
+        if cache is not None:
+            cache.put(request, completion)
+        return completion
+
+    async def run(request: dict):
+        if callable(request):
+            request = await request()
+        if request is None:
+            return None
+        completion = await send(request)
+        if repair is None or isinstance(completion, Exception):
+            return completion
+        follow_up = repair(request, completion)
+        if follow_up is None:
+            return completion
+        return Repaired(completion, await send(follow_up))
+
+    async def run_cascade(tag, request: dict):
+        if callable(request):
+            request = await request()
+        completion = await send(request) if request is not None else None
+        follow_ups = escalate(tag, completion)
+        if not follow_ups:
+            return completion
+        return Escalated(completion, list(await asyncio.gather(*map(run, follow_ups))))
+
+    try:
+        for tag, request in items:
+            task = run(request) if escalate is None else run_cascade(tag, request)
+            window.append((tag, asyncio.ensure_future(task)))
+            while len(window) >= concurrency * WINDOW_PER_WORKER:
+                tag, task = window.popleft()
+                yield tag, await task
+        while window:
+            tag, task = window.popleft()
+            yield tag, await task
+    finally:
+        for tag, task in window:
+            task.cancel()
+        if cache is not None:
+            cache.flush()
+        if owns_clients:
+            await clients.close()
+
+
+def iter_grades(items, **kwargs):
+    """
+    Blocking generator over `grade_stream` for callers without an event loop.
+    """
+    loop = asyncio.new_event_loop()
+    stream = grade_stream(items, **kwargs)
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(stream.__anext__())
+            except StopAsyncIteration:
+                return
+    finally:
+        loop.run_until_complete(stream.aclose())
+        loop.close()
+
+
+def grade(requests: list, **kwargs) -> list:
+    """
+    Grade a list of requests, returning the results in the same order.
+    """
+    return [result for _, result in iter_grades(((None, request) for request in requests), **kwargs)]
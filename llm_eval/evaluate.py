@@ -0,0 +1,526 @@
+"""
+Evaluation of a sheet: prompt building, grading and parsing into result rows.
+
+A metric is a dict with a "name", the "columns" it grades and its
+"system_prompt", and optionally its "judge" ("provider:model", see
+`providers`) and the "context_budget" in tokens its requests are packed
+into. Result rows keep the layout of the Streamlit
+tables: Index, Metric, Selected Columns, Score, Criteria, Supporting
+Evidence, Tokens Sent, Parse Status, followed by the data columns the row
+was loaded with. Rows stream from the sheet to the judge and results
+stream back out in sheet order.
+
+Replies that cannot be parsed get one repair call (see `structured`); the
+Parse Status of a result is "parsed", "repaired" or "failed". Metrics
+with a "cascade" are scored by a cheap judge first and only graded in
+full where that score is close to the threshold (see `cascade`). A row
+whose requests are identical to a recent row's reuses that row's grade
+instead of being sent again, with the Parse Status "reused", unless
+grading that row failed.
+
+Passing a `timing.RunStats` as `stats` records throughput, call latencies
+and the time spent in each stage of the run.
+"""
+import asyncio
+import collections
+import math
+
+from llm_eval.cache import request_key
+from llm_eval.cascade import ESCALATED, EXITED, SAMPLED, agrees, cheap_judge, in_sample, route
+from llm_eval.engine import Cached, Escalated, Repaired, iter_grades
+from llm_eval.fused import build_fused_request, parse_fused_response
+from llm_eval.loading import REQUIRED_COLUMNS, needed_columns
+from llm_eval.parsing import RESULT_FIELDS, MalformedReply, parse_numbered_response, parse_prefixed_response
+from llm_eval.prompts import DEFAULT_MODELS, build_agentic_requests, build_rag_request
+from llm_eval.providers import fast_judge
+from llm_eval.results import REUSED, normalize_score
+from llm_eval.structured import build_repair_request, fused_format, grade_format, parse_grade
+from llm_eval.timing import API_ROUND_TRIP, FILE_PARSING, PROMPT_CONSTRUCTION, RESPONSE_PARSING, RunStats
+from llm_eval.tokens import count_prompt_tokens
+
+RESULT_HEAD = ["Index", "Metric", "Selected Columns", *RESULT_FIELDS, "Tokens Sent", "Parse Status"]
+# From best to worst; a row graded in windows gets the worst status of its windows
+PARSE_STATUSES = ("parsed", "repaired", "failed")
+# Distinct rows remembered for reuse; identical rows further apart are left to the response cache
+DEDUPE_WINDOW = 10000
+
+
+def build_requests(mode: str, row, metric: dict, structured: bool = False, score_only: bool = False) -> list:
+    """
+    The requests grading one row on one metric: a single request, or one per conversation window.
+    """
+    judge = metric.get("judge") or DEFAULT_MODELS[mode]
+    if mode == "agentic":
+        return build_agentic_requests(row, metric["system_prompt"], judge, metric.get("context_budget"), structured,
+                                      score_only)
+    return [build_rag_request(row, metric["system_prompt"], metric["columns"], judge, structured, score_only)]
+
+
+def tokens_sent(response, request: dict = None):
+    """
+    Prompt tokens of one call, as billed when the response reports usage and counted from the request otherwise.
+
+    A repaired response also counts its repair call; a call that raised
+    or was served from the cache sent nothing that was billed, and counts 0.
+    """
+    if isinstance(response, (Exception, Cached)):
+        return 0
+    if isinstance(response, Repaired):
+        sent = tokens_sent(response.completion, request)
+        return None if sent is None else sent + (tokens_sent(response.repair) or 0)
+    usage = getattr(response, "usage", None)
+    if usage is not None and usage.prompt_tokens:
+        return usage.prompt_tokens
+    return count_prompt_tokens(request) if request is not None else None
+
+
+def row_data(mode: str, row) -> dict:
+    """
+    The row's data columns as copied into its result rows.
+    """
+    return {col: row[col] for col in REQUIRED_COLUMNS[mode][1:] if col in row}
+
+
+def result_columns(mode: str, metrics: list) -> list:
+    """
+    Every column a result row of this evaluation can have, in table order.
+    """
+    return RESULT_HEAD + needed_columns(mode, metrics)[1:] + ["Error"]
+
+
+def parse_reply(mode: str, response_content: str, structured: bool = False) -> dict:
+    """
+    Parse one judge reply into result fields, raising MalformedReply if it does not have the expected format.
+    """
+    if structured:
+        return parse_grade(response_content).fields()
+    if mode == "agentic":
+        return parse_prefixed_response(response_content)
+    parsed = parse_numbered_response(response_content)
+    if parsed["Score"] == "Not available":
+        raise MalformedReply("Response has no numbered Score section.")
+    return parsed
+
+
+def _content(completion) -> str:
+    if isinstance(completion, Cached):
+        completion = completion.completion
+    return (completion.choices[0].message.content or "").strip()
+
+
+def repair_hook(parse, response_format: dict):
+    """
+    The engine's `repair` callback: a repair request for each reply that `parse` rejects.
+
+    Repairs go to the fast model of the judge's provider.
+    """
+    def repair(request: dict, completion):
+        content = _content(completion)
+        try:
+            parse(content)
+        except MalformedReply as e:
+            return build_repair_request(content, response_format, str(e), fast_judge(request["model"]))
+        return None
+    return repair
+
+
+def parse_response(response, parse, parse_repair):
+    """
+    Parse a response with `parse`, or its repair with `parse_repair`; returns (fields, parse status).
+
+    Raises the response's exception, or MalformedReply if neither the reply
+    nor its repair parses.
+    """
+    if isinstance(response, Exception):
+        raise response
+    repair = None
+    if isinstance(response, Repaired):
+        response, repair = response
+    try:
+        return parse(_content(response)), "parsed"
+    except MalformedReply as e:
+        error = e
+    if repair is not None and not isinstance(repair, Exception):
+        try:
+            return parse_repair(_content(repair)), "repaired"
+        except MalformedReply:
+            pass
+    raise error
+
+
+class Duplicates:
+    """
+    The grades of recent rows, so a row whose requests are identical to one of theirs is not sent again.
+
+    `claim` hands out a slot per distinct row; the first row of a slot
+    fills it with its results once graded, and the identical rows after
+    it copy them. Their requests wait in the engine (see `deferred`) until
+    the first row's grade is in: a failed grade is not kept, and they are
+    sent after all. Results come back in sheet order, so a slot is always
+    filled before an identical row's turn.
+    """
+
+    def __init__(self, window: int = DEDUPE_WINDOW):
+        self.window = window
+        self.recent = collections.OrderedDict()
+
+    def claim(self, requests) -> tuple:
+        """
+        The slot for a row's requests, and whether an earlier identical row fills it.
+        """
+        key = request_key({"requests": requests})
+        slot = self.recent.get(key)
+        if slot is not None:
+            self.recent.move_to_end(key)
+            return slot, True
+        slot = self.recent[key] = {"key": key, "settled": asyncio.Event()}
+        if len(self.recent) > self.window:
+            self.recent.popitem(last=False)
+        return slot, False
+
+    def fill(self, slot: dict, mode: str, row, results: list, requests: int):
+        """
+        Keep a graded row's results, without its data columns, for the rows identical to it, unless grading failed.
+        """
+        if any(failed(result) for result in results):
+            # Rows claimed from now on are graded afresh
+            if self.recent.get(slot["key"]) is slot:
+                del self.recent[slot["key"]]
+        else:
+            data = row_data(mode, row)
+            slot["grades"] = [{col: value for col, value in result.items() if col not in data} for result in results]
+            slot["requests"] = requests
+        slot["settled"].set()
+
+    @staticmethod
+    def deferred(slot: dict, request: dict):
+        """
+        The engine request of an identical row: None once the slot is filled, or `request` if its grade failed.
+        """
+        async def decide():
+            await slot["settled"].wait()
+            return None if "grades" in slot else request
+        return decide
+
+    @staticmethod
+    def reuse(slot: dict, mode: str, row, stats: RunStats) -> list:
+        """
+        The results of an identical row's grades for `row`, counting the requests and tokens saved.
+        """
+        grades = slot["grades"]
+        stats.duplicates.update(rows=1, requests=slot["requests"],
+                                tokens=sum(grade.get("Tokens Sent") or 0 for grade in grades))
+        return [{**grade, "Index": row["Index"], "Tokens Sent": 0, "Parse Status": REUSED, **row_data(mode, row)}
+                for grade in grades]
+
+
+def failed(result: dict) -> bool:
+    """
+    Whether a result row records a failed grade: an error, or a reply that could not be parsed.
+    """
+    return result["Criteria"] == "Error" or result.get("Error") is not None or result["Parse Status"] == "failed"
+
+
+def combine_windows(parsed: list, weights: list) -> dict:
+    """
+    Reduce the grades of a conversation's windows to one grade.
+
+    The score is the mean of the windows' numeric scores weighted by their
+    tokens; criteria and evidence are kept for each part.
+    """
+    scored = [(normalize_score(grade["Score"]), weight) for grade, weight in zip(parsed, weights)]
+    scored = [(value, weight or 1) for value, weight in scored if not math.isnan(value)]
+    if scored:
+        score = f"{sum(value * weight for value, weight in scored) / sum(weight for _, weight in scored):.1f}"
+    else:
+        score = "; ".join(grade["Score"] for grade in parsed)
+    parts = len(parsed)
+    return {
+        "Score": score,
+        **{
+            field: "\n\n".join(f"Part {part} of {parts}: {grade[field]}" for part, grade in enumerate(parsed, start=1))
+            for field in RESULT_FIELDS[1:]
+        }
+    }
+
+
+def result_row(mode: str, row, metric: dict, responses: list, requests: list = None, structured: bool = False) -> dict:
+    """
+    Parse the judge responses for one row (or the exceptions raised instead) into a result row.
+
+    `responses` has one entry per request built for the row; the grades of
+    conversation windows are combined.
+    """
+    head = {"Index": row["Index"], "Metric": metric["name"], "Selected Columns": ", ".join(metric["columns"])}
+    requests = requests or [None] * len(responses)
+    tokens = [tokens_sent(response, request) for response, request in zip(responses, requests)]
+    spent = {"Tokens Sent": sum(tokens) if None not in tokens else None}
+    parsed, statuses = [], []
+
+    def parse(content: str) -> dict:
+        return parse_reply(mode, content, structured)
+
+    def parse_repair(content: str) -> dict:
+        return parse_grade(content).fields()
+
+    try:
+        for response in responses:
+            try:
+                fields, status = parse_response(response, parse, parse_repair)
+            except MalformedReply:
+                if structured or mode == "agentic":
+                    raise
+                # Numbered replies have always been kept with their missing sections marked
+                response = response.completion if isinstance(response, Repaired) else response
+                fields, status = parse_numbered_response(_content(response)), "failed"
+            parsed.append(fields)
+            statuses.append(status)
+        graded = parsed[0] if len(parsed) == 1 else combine_windows(parsed, tokens)
+        status = max(statuses, key=PARSE_STATUSES.index)
+        return {**head, **graded, **spent, "Parse Status": status, **row_data(mode, row)}
+    except Exception as e:
+        spent["Parse Status"] = "failed" if isinstance(e, MalformedReply) else None
+        if mode == "agentic":
+            return {**head, "Score": "N/A", "Criteria": "Error",
+                    "Supporting Evidence": f"Error processing conversation: {e}", **spent, **row_data(mode, row)}
+        return {**head, **dict.fromkeys(RESULT_FIELDS, "Error"), **spent, **row_data(mode, row), "Error": str(e)}
+
+
+def iter_metric_results(rows, mode: str, metric: dict, done: set = frozenset(), structured: bool = False,
+                        stats: RunStats = None, **grading):
+    """
+    Grade each row on one metric, yielding result rows in sheet order.
+
+    Rows whose (Index, Metric) pair is in `done` are skipped. `structured`
+    requests JSON grades under a strict schema. `grading` is passed on to
+    `engine.grade_stream`.
+    """
+    if metric.get("cascade"):
+        yield from iter_cascade_results(rows, mode, metric, done, structured, stats, **grading)
+        return
+    stats = stats if stats is not None else RunStats()
+    duplicates = Duplicates()
+
+    def pairs():
+        for row in stats.timed(FILE_PARSING, rows):
+            if (str(row["Index"]), metric["name"]) not in done:
+                with stats.stage(PROMPT_CONSTRUCTION):
+                    requests = build_requests(mode, row, metric, structured)
+                    slot, reused = duplicates.claim(requests)
+                for request in requests:
+                    yield (row, requests, slot, reused), duplicates.deferred(slot, request) if reused else request
+
+    repair = repair_hook(lambda content: parse_reply(mode, content, structured), grade_format())
+    grades = iter_grades(pairs(), repair=repair, stats=stats, **grading)
+    # Windows of a row are dispatched together and come back in order, so their results are consecutive
+    responses = []
+    for (row, requests, slot, reused), response in stats.timed(API_ROUND_TRIP, grades):
+        responses.append(response)
+        if len(responses) < len(requests):
+            continue
+        if reused and "grades" in slot:
+            result, = duplicates.reuse(slot, mode, row, stats)
+        else:
+            with stats.stage(RESPONSE_PARSING):
+                result = result_row(mode, row, metric, responses, requests, structured)
+            if not reused:
+                duplicates.fill(slot, mode, row, [result], len(requests))
+        responses = []
+        stats.rows += 1
+        stats.results += 1
+        yield result
+
+
+def iter_cascade_results(rows, mode: str, metric: dict, done: set = frozenset(), structured: bool = False,
+                         stats: RunStats = None, **grading):
+    """
+    Grade each row on a cascaded metric, yielding result rows in sheet order.
+
+    Every row is scored by the cheap judge, and rows escalated by
+    `cascade.route` are graded in full as well; the others keep the cheap
+    score. Counts of full-judge requests saved and spot-check agreement go
+    to `stats`.
+    """
+    stats = stats if stats is not None else RunStats()
+    settings = metric["cascade"]
+    judge = cheap_judge(metric, DEFAULT_MODELS[mode])
+    cheap_metric = {**metric, "judge": judge}
+    duplicates = Duplicates()
+
+    def pairs():
+        for row in stats.timed(FILE_PARSING, rows):
+            if (str(row["Index"]), metric["name"]) not in done:
+                with stats.stage(PROMPT_CONSTRUCTION):
+                    requests = build_requests(mode, row, metric, structured)
+                    slot, reused = duplicates.claim(requests)
+                    cheap = build_requests(mode, row, cheap_metric, score_only=True)
+                # Rows graded in windows go straight to the full grade
+                cheap = cheap[0] if len(requests) == len(cheap) == 1 else None
+                yield (row, requests, cheap, slot, reused), duplicates.deferred(slot, cheap) if reused else cheap
+
+    def cheap_score(completion) -> float:
+        return math.nan if completion is None or isinstance(completion, Exception) else normalize_score(_content(completion))
+
+    def routed(row, completion) -> str:
+        return route(cheap_score(completion), settings, in_sample(metric["name"], row["Index"], settings["sample_rate"]))
+
+    def escalate(tag, completion):
+        row, requests, _, slot, reused = tag
+        if reused and "grades" in slot:
+            return None
+        return requests if routed(row, completion) != EXITED else None
+
+    repair = repair_hook(lambda content: parse_reply(mode, content, structured), grade_format())
+    grades = iter_grades(pairs(), repair=repair, escalate=escalate, stats=stats, **grading)
+    for (row, requests, cheap, slot, reused), response in stats.timed(API_ROUND_TRIP, grades):
+        if reused and "grades" in slot:
+            stats.rows += 1
+            stats.results += 1
+            yield from duplicates.reuse(slot, mode, row, stats)
+            continue
+        with stats.stage(RESPONSE_PARSING):
+            completion = response.completion if isinstance(response, Escalated) else response
+            score = cheap_score(completion)
+            cheap_tokens = (tokens_sent(completion, cheap) or 0) if cheap is not None else 0
+            if isinstance(response, Escalated):
+                result = result_row(mode, row, metric, response.results, requests, structured)
+                if result["Tokens Sent"] is not None:
+                    result["Tokens Sent"] += cheap_tokens
+            else:
+                result = {
+                    "Index": row["Index"],
+                    "Metric": metric["name"],
+                    "Selected Columns": ", ".join(metric["columns"]),
+                    "Score": f"{score:g}",
+                    "Criteria": f"Score-only grade by {judge}; not escalated for a full grade.",
+                    "Supporting Evidence": "Not available",
+                    "Tokens Sent": cheap_tokens,
+                    "Parse Status": "parsed",
+                    **row_data(mode, row)
+                }
+        outcome = routed(row, completion) if cheap is not None else ESCALATED
+        full_score = normalize_score(result["Score"])
+        full_requests_sent = len(requests) if outcome != EXITED else 0
+        stats.cascade.update(
+            rows=1,
+            cheap_requests=int(cheap is not None),
+            cheap_tokens=cheap_tokens,
+            full_requests_sent=full_requests_sent,
+            full_requests=len(requests),
+            full_tokens_saved=sum(map(count_prompt_tokens, requests)) if outcome == EXITED else 0,
+            escalated=int(outcome != EXITED)
+        )
+        if not reused:
+            duplicates.fill(slot, mode, row, [result], (cheap is not None) + full_requests_sent)
+        if outcome == SAMPLED and not math.isnan(full_score):
+            stats.cascade.update(sampled=1, agreed=int(agrees(score, full_score, settings["threshold"])))
+        stats.rows += 1
+        stats.results += 1
+        yield result
+
+
+def iter_fused_results(rows, metrics: list, done: set = frozenset(), structured: bool = False,
+                       stats: RunStats = None, **grading):
+    """
+    Grade each Question/Context/Answer row on all metrics with one call per row.
+
+    Rows already graded on every metric in `done` are skipped. The call goes
+    to the first metric's judge; metrics' cascades do not apply.
+    """
+    # Send the union of the metrics' columns once per row
+    columns = needed_columns("rag", metrics)[1:]
+    judge = metrics[0].get("judge") or DEFAULT_MODELS["rag"]
+    stats = stats if stats is not None else RunStats()
+    duplicates = Duplicates()
+
+    def pairs():
+        for row in stats.timed(FILE_PARSING, rows):
+            pending = [metric["name"] for metric in metrics if (str(row["Index"]), metric["name"]) not in done]
+            if pending:
+                with stats.stage(PROMPT_CONSTRUCTION):
+                    request = build_fused_request(metrics, row, columns, judge, structured)
+                    # Only a row needing the same metrics can reuse another's results
+                    slot, reused = duplicates.claim([request, pending])
+                yield (row, request, slot, reused), duplicates.deferred(slot, request) if reused else request
+
+    def parse(content: str) -> dict:
+        parsed = parse_fused_response(content, metrics, strict=structured)
+        missing = [name for name, fields in parsed.items() if fields["Score"] == "Not available"]
+        if missing:
+            raise MalformedReply(f"Response has no Score for {', '.join(missing)}.")
+        return parsed
+
+    def parse_repair(content: str) -> dict:
+        return parse_fused_response(content, metrics, strict=True)
+
+    grades = iter_grades(pairs(), repair=repair_hook(parse, fused_format(metrics)), stats=stats, **grading)
+    for (row, request, slot, reused), response in stats.timed(API_ROUND_TRIP, grades):
+        if reused and "grades" in slot:
+            results = duplicates.reuse(slot, "rag", row, stats)
+        else:
+            with stats.stage(RESPONSE_PARSING):
+                results = fused_result_rows(row, metrics, request, response, parse, parse_repair, done, structured)
+            if not reused:
+                duplicates.fill(slot, "rag", row, results, 1)
+        stats.rows += 1
+        stats.results += len(results)
+        yield from results
+
+
+def fused_result_rows(row, metrics: list, request: dict, response, parse, parse_repair, done: set,
+                      structured: bool) -> list:
+    """
+    Split one fused response (or the exception raised instead) into a result row per metric not in `done`.
+    """
+    # The call's tokens are shared between the metrics it scored
+    tokens = tokens_sent(response, request)
+    shares = [tokens // len(metrics) + (position < tokens % len(metrics)) for position in range(len(metrics))]
+    try:
+        parsed, status = parse_response(response, parse, parse_repair)
+        error = None
+    except MalformedReply as e:
+        if structured:
+            parsed = {metric["name"]: dict.fromkeys(RESULT_FIELDS, "Error") for metric in metrics}
+            error = str(e)
+        else:
+            # Unstructured fused replies have always been kept with their missing fields marked
+            response = response.completion if isinstance(response, Repaired) else response
+            parsed, error = parse_fused_response(_content(response), metrics), None
+        status = "failed"
+    except Exception as e:
+        parsed = {metric["name"]: dict.fromkeys(RESULT_FIELDS, "Error") for metric in metrics}
+        error, status = str(e), None
+
+    results = []
+    for metric, share in zip(metrics, shares):
+        if (str(row["Index"]), metric["name"]) in done:
+            continue
+        result = {
+            "Index": row["Index"],
+            "Metric": metric["name"],
+            "Selected Columns": ", ".join(metric["columns"]),
+            **parsed[metric["name"]],
+            "Tokens Sent": share,
+            "Parse Status": status,
+            **row_data("rag", row)
+        }
+        if error is not None:
+            result["Error"] = error
+        results.append(result)
+    return results
+
+
+def iter_results(sheet, mode: str, metrics: list, fused: bool = False, done: set = frozenset(),
+                 structured: bool = False, stats: RunStats = None, **grading):
+    """
+    Stream every row of `sheet` through every metric, metric by metric unless `fused`.
+    """
+    if fused:
+        if mode != "rag":
+            raise ValueError("Fused evaluation is only available for Question/Context/Answer sheets.")
+        rows = sheet.rows(needed_columns(mode, metrics))
+        yield from iter_fused_results(rows, metrics, done, structured, stats, **grading)
+    else:
+        for metric in metrics:
+            rows = sheet.rows(needed_columns(mode, [metric]))
+            yield from iter_metric_results(rows, mode, metric, done, structured, stats, **grading)
@@ -0,0 +1,76 @@
+"""
+Fused grading: every metric for a row scored in a single call.
+
+Every metric's system prompt is sent once, in the system message shared by
+all rows, followed by the row data, and the judge answers with one JSON
+object holding every metric's Criteria, Supporting Evidence and Score.
+"""
+import json
+
+from llm_eval.parsing import RESULT_FIELDS, MalformedReply
+from llm_eval.structured import JSON_OBJECT_FORMAT, fused_format, to_grade, with_format
+
+
+def build_fused_request(metrics: list, row, columns: list, model: str = "gpt-4o", structured: bool = False) -> dict:
+    """
+    Build one chat completion request grading `row` on every metric.
+
+    Each metric is a dict with "name", "columns" and "system_prompt"; `columns`
+    is the union of the metrics' columns, in the order they are sent. A
+    `structured` request constrains the reply with a strict JSON schema
+    rather than only asking for a JSON object, where the model supports it
+    (see `structured.supported_format`).
+    """
+    row_data = "".join(f"{col}: {row[col]}\n" for col in columns)
+    metric_sections = "\n".join(
+        f"### {metric['name']}\n"
+        f"Columns to consider: {', '.join(metric['columns'])}\n"
+        f"{metric['system_prompt']}\n"
+        for metric in metrics
+    )
+    metric_names = ", ".join(f'"{metric["name"]}"' for metric in metrics)
+    evaluator_prompt = f"""You are an evaluator analyzing the provided data.
+
+Evaluate the data against each of the following metrics independently, using only the columns listed for that metric.
+
+{metric_sections}
+Respond with a JSON object with one key per metric ({metric_names}). Each value must be an object with the keys:
+"Criteria": a detailed explanation of how the evaluation is derived,
+"Supporting Evidence": specific examples from the data supporting the evaluation,
+"Score": {"a number" if structured else "a numerical or qualitative score"}."""
+    request = {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": evaluator_prompt},
+            {"role": "user", "content": f"Below is the data for evaluation:\n{row_data}"}
+        ]
+    }
+    return with_format(request, fused_format(metrics) if structured else JSON_OBJECT_FORMAT)
+
+
+def parse_fused_response(response_content: str, metrics: list, strict: bool = False) -> dict:
+    """
+    Split a fused JSON reply into {metric name: {"Criteria", "Supporting Evidence", "Score"}}.
+
+    Fields missing for a metric are reported as "Not available", unless
+    `strict`, when every metric must have a complete Grade. A reply that is
+    not a JSON object raises MalformedReply.
+    """
+    try:
+        data = json.loads(response_content)
+    except json.JSONDecodeError as e:
+        raise MalformedReply(f"Response is not valid JSON: {e}") from None
+    if not isinstance(data, dict):
+        raise MalformedReply("Response is not a JSON object.")
+    if strict:
+        return {metric["name"]: to_grade(data.get(metric["name"])).fields() for metric in metrics}
+    parsed = {}
+    for metric in metrics:
+        entry = data.get(metric["name"])
+        if not isinstance(entry, dict):
+            entry = {}
+        parsed[metric["name"]] = {
+            field: str(entry[field]).strip() if entry.get(field) not in (None, "") else "Not available"
+            for field in RESULT_FIELDS
+        }
+    return parsed
@@ -0,0 +1,146 @@
+"""
+Streaming loading of evaluation sheets.
+
+Sheets are never loaded whole: CSV files are read in chunks and .xlsx files
+through openpyxl's read-only mode, projected down to the columns an
+evaluation uses, and handed on one lightweight tuple per row.
+"""
+import hashlib
+import io
+
+import openpyxl
+import pandas as pd
+
+RAG_COLUMNS = ["Index", "Question", "Context", "Answer", "Reference Context", "Reference Answer"]
+AGENTIC_COLUMNS = ["Index", "Conversation", "Agent Prompt"]
+REQUIRED_COLUMNS = {"rag": RAG_COLUMNS, "agentic": AGENTIC_COLUMNS}
+
+DEFAULT_CHUNKSIZE = 1000
+
+
+class Row(tuple):
+    """
+    A sheet row as a plain tuple whose values can also be looked up by column name.
+    """
+    __slots__ = ()
+    positions = {}
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return tuple.__getitem__(self, self.positions[key])
+        return tuple.__getitem__(self, key)
+
+    def __contains__(self, key):
+        return key in self.positions
+
+    def get(self, key, default=None):
+        return self[key] if key in self.positions else default
+
+    def keys(self):
+        return list(self.positions)
+
+
+def row_type(columns: list) -> type:
+    """
+    A Row subclass for tuples holding `columns` in order.
+    """
+    return type("Row", (Row,), {"__slots__": (), "positions": {col: i for i, col in enumerate(columns)}})
+
+
+class Sheet:
+    """
+    An .xlsx or .csv sheet, given as a path or as the uploaded bytes, read lazily.
+    """
+
+    def __init__(self, source, name: str = None, chunksize: int = DEFAULT_CHUNKSIZE):
+        self.source = source
+        self.name = str(name or source)
+        self.chunksize = chunksize
+
+    @property
+    def is_excel(self) -> bool:
+        return self.name.endswith(".xlsx")
+
+    def _open(self):
+        return io.BytesIO(self.source) if isinstance(self.source, bytes) else self.source
+
+    def _excel_rows(self):
+        workbook = openpyxl.load_workbook(self._open(), read_only=True, data_only=True)
+        try:
+            for values in workbook.active.iter_rows(values_only=True):
+                # Read-only mode also yields trailing rows that only carry formatting
+                if any(value is not None for value in values):
+                    yield values
+        finally:
+            workbook.close()
+
+    @property
+    def columns(self) -> list:
+        """
+        The header row, read without loading the data.
+        """
+        if self.is_excel:
+            header = next(self._excel_rows(), ())
+            return [str(col) for col in header if col is not None]
+        return list(pd.read_csv(self._open(), nrows=0).columns)
+
+    def digest(self) -> str:
+        """
+        A hash of the sheet's file content, read in blocks.
+        """
+        digest = hashlib.sha256()
+        if isinstance(self.source, bytes):
+            digest.update(self.source)
+        else:
+            with open(self.source, "rb") as sheet:
+                for block in iter(lambda: sheet.read(1024 * 1024), b""):
+                    digest.update(block)
+        return digest.hexdigest()
+
+    def head(self, n: int = 5) -> pd.DataFrame:
+        if self.is_excel:
+            rows = self._excel_rows()
+            header = next(rows, ())
+            return pd.DataFrame([values for _, values in zip(range(n), rows)], columns=header)
+        return pd.read_csv(self._open(), nrows=n)
+
+    def rows(self, columns: list):
+        """
+        Yield every data row as a Row holding only `columns`.
+        """
+        make_row = row_type(columns)
+        if self.is_excel:
+            rows = self._excel_rows()
+            header = [str(col) for col in next(rows, ())]
+            positions = [header.index(col) for col in columns]
+            for values in rows:
+                yield make_row(values[position] if position < len(values) else None for position in positions)
+        else:
+            for chunk in pd.read_csv(self._open(), usecols=columns, chunksize=self.chunksize):
+                yield from map(make_row, chunk[columns].itertuples(index=False, name=None))
+
+
+def detect_mode(columns) -> str:
+    """
+    Return "rag" for Question/Context/Answer sheets, "agentic" for Conversation/Agent Prompt sheets, else None.
+    """
+    if "Question" in columns and "Context" in columns and "Answer" in columns:
+        return "rag"
+    if "Conversation" in columns and "Agent Prompt" in columns:
+        return "agentic"
+    return None
+
+
+def missing_columns(mode: str, columns) -> list:
+    return [col for col in REQUIRED_COLUMNS[mode] if col not in columns]
+
+
+def needed_columns(mode: str, metrics: list) -> list:
+    """
+    The columns an evaluation reads: Index plus every column a metric grades.
+
+    Conversation prompts always include both the conversation and the agent prompt.
+    """
+    if mode == "agentic":
+        return AGENTIC_COLUMNS
+    return ["Index"] + [col for col in RAG_COLUMNS[1:] if any(col in metric["columns"] for metric in metrics)]
@@ -0,0 +1,325 @@
+"""
+Local stand-in for the OpenAI chat completions, files and batches endpoints.
+
+Chat completions are held to requests-per-minute and tokens-per-minute
+limits, answering 429 with rate-limit headers when they are exceeded and a
+canned grade otherwise, so throughput can be measured without paying for
+calls. Like the API, a system message seen before is reported as served
+from the prompt cache once it is 1024 tokens long. A `malformed_rate`
+share of grading replies ignore the requested format, to exercise the
+repair path. Batches complete `batch_delay` seconds after they are
+created:
+
+    python -m llm_eval.mock_server --port 8011 --rpm 600 --tpm 60000 --latency 0.2 --batch-delay 5
+"""
+import argparse
+import collections
+import hashlib
+import json
+import re
+import threading
+import time
+import uuid
+from email.parser import BytesParser
+from email.policy import default as default_policy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from llm_eval.prompts import SCORE_ONLY_INSTRUCTIONS
+from llm_eval.structured import STRUCTURED_INSTRUCTIONS
+from llm_eval.tokens import count_prompt_tokens, count_tokens, estimate_request_tokens
+
+NUMBERED_REPLY = """1. Criteria: The answer addresses the question using the given data.
+2. Supporting Evidence: The key facts in the answer appear in the provided context.
+3. Score: 8"""
+PLAIN_REPLY = """Criteria: The agent followed the agent prompt throughout the conversation.
+Supporting Evidence: No faulty or insufficient responses were found.
+Score: 8"""
+MALFORMED_REPLY = "The answer addresses the question well and uses the context; I would rate it an 8 out of 10."
+JSON_REPLY = {
+    "Criteria": "The answer addresses the question using the given data.",
+    "Supporting Evidence": "The key facts in the answer appear in the provided context.",
+    "Score": 8,
+}
+# The API caches prompt prefixes from this length on, in steps of PROMPT_CACHE_STEP tokens
+PROMPT_CACHE_MIN_TOKENS = 1024
+PROMPT_CACHE_STEP = 128
+
+
+class MockState:
+    """
+    Request and token budgets shared by all handler threads, replenished continuously like the API's.
+    """
+
+    def __init__(self, rpm: int, tpm: int, latency: float, batch_delay: float = 0.0, malformed_rate: float = 0.0):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.latency = latency
+        self.batch_delay = batch_delay
+        self.malformed_rate = malformed_rate
+        self.files = {}
+        self.batches = {}
+        self.available_requests = float(rpm)
+        self.available_tokens = float(tpm)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+        self.served = 0
+        self.rejected = 0
+        self.prompt_prefixes = set()
+
+    def admit(self, tokens: int):
+        """
+        Charge the request against the budgets if it fits; return (admitted, headers).
+        """
+        with self.lock:
+            now = time.monotonic()
+            elapsed = now - self.updated
+            self.updated = now
+            self.available_requests = min(self.rpm, self.available_requests + elapsed * self.rpm / 60)
+            self.available_tokens = min(self.tpm, self.available_tokens + elapsed * self.tpm / 60)
+            admitted = self.available_requests >= 1 and self.available_tokens >= tokens
+            if admitted:
+                self.available_requests -= 1
+                self.available_tokens -= tokens
+                self.served += 1
+            else:
+                self.rejected += 1
+            reset_requests = (self.rpm - self.available_requests) * 60 / self.rpm
+            reset_tokens = (self.tpm - self.available_tokens) * 60 / self.tpm
+            headers = {
+                "x-ratelimit-limit-requests": str(self.rpm),
+                "x-ratelimit-limit-tokens": str(self.tpm),
+                "x-ratelimit-remaining-requests": str(int(self.available_requests)),
+                "x-ratelimit-remaining-tokens": str(int(self.available_tokens)),
+                "x-ratelimit-reset-requests": f"{reset_requests:.3f}s",
+                "x-ratelimit-reset-tokens": f"{reset_tokens:.3f}s",
+            }
+            if not admitted:
+                wait = max((1 - self.available_requests) * 60 / self.rpm, (tokens - self.available_tokens) * 60 / self.tpm)
+                headers["retry-after-ms"] = str(int(wait * 1000) + 1)
+            return admitted, headers
+
+
+def cached_prefix_tokens(request: dict, seen: set) -> int:
+    """
+    The prompt tokens the API would serve from its prompt cache: those of a system message in `seen`.
+
+    The request's system message is added to `seen`.
+    """
+    messages = request.get("messages") or []
+    if not messages or messages[0].get("role") != "system":
+        return 0
+    prefix = (request.get("model"), str(messages[0].get("content") or ""))
+    if prefix not in seen:
+        seen.add(prefix)
+        return 0
+    tokens = count_tokens(prefix[1])
+    return tokens // PROMPT_CACHE_STEP * PROMPT_CACHE_STEP if tokens >= PROMPT_CACHE_MIN_TOKENS else 0
+
+
+def chat_completion(request: dict, prompt_tokens: int, malformed_rate: float = 0.0, cached_tokens: int = 0) -> dict:
+    """
+    Build a chat completion body in the API's response shape.
+    """
+    prompt = "\n".join(str(message.get("content") or "") for message in request.get("messages", []))
+    response_format = request.get("response_format") or {}
+    # The same prompt is always malformed or always not; repair requests always get a well-formed answer
+    draw = int(hashlib.sha256(prompt.encode()).hexdigest()[:8], 16) / 16 ** 8
+    if "could not be read" not in prompt and draw < malformed_rate:
+        content = MALFORMED_REPLY
+    elif SCORE_ONLY_INSTRUCTIONS in prompt:
+        # Spread cheap scores around the grades' 8 so cascades escalate some rows
+        content = str(4 + int(hashlib.sha256(prompt.encode()).hexdigest()[8:16], 16) % 7)
+    elif response_format.get("type") == "json_schema":
+        schema = response_format["json_schema"]["schema"]
+        if "Score" in schema["properties"]:
+            content = json.dumps(JSON_REPLY)
+        else:
+            content = json.dumps({name: JSON_REPLY for name in schema["properties"]})
+    elif re.search(r"^### ", prompt, re.M):
+        # Fused requests name each metric in a "### <name>" heading, with or without the JSON object format
+        content = json.dumps({name: JSON_REPLY for name in re.findall(r"^### (.+)$", prompt, re.M)})
+    elif response_format.get("type") == "json_object" or STRUCTURED_INSTRUCTIONS in prompt:
+        # Judges without schema support are asked for the JSON Grade in the prompt
+        content = json.dumps(JSON_REPLY)
+    else:
+        content = NUMBERED_REPLY if "1. Criteria" in prompt else PLAIN_REPLY
+    completion_tokens = len(content) // 4
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": request.get("model", "mock"),
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": cached_tokens},
+        },
+    }
+
+
+def file_object(file_id: str, filename: str, content: bytes, purpose: str) -> dict:
+    return {
+        "id": file_id,
+        "object": "file",
+        "bytes": len(content),
+        "created_at": int(time.time()),
+        "filename": filename,
+        "purpose": purpose,
+        "status": "processed",
+    }
+
+
+def run_batch(state: MockState, batch: dict):
+    """
+    Answer every line of a batch's input file and attach the output file.
+    """
+    output_lines = []
+    for line in state.files[batch["input_file_id"]]["content"].decode("utf-8").splitlines():
+        if not line.strip():
+            continue
+        item = json.loads(line)
+        body = chat_completion(item["body"], count_prompt_tokens(item["body"]), state.malformed_rate)
+        output = {
+            "id": f"batch_req_{uuid.uuid4().hex}",
+            "custom_id": item["custom_id"],
+            "response": {"status_code": 200, "request_id": uuid.uuid4().hex, "body": body},
+            "error": None,
+        }
+        output_lines.append(json.dumps(output))
+    content = ("\n".join(output_lines) + "\n").encode("utf-8")
+    output_file_id = f"file-{uuid.uuid4().hex}"
+    state.files[output_file_id] = {"object": file_object(output_file_id, "output.jsonl", content, "batch_output"), "content": content}
+    batch.update({
+        "status": "completed",
+        "output_file_id": output_file_id,
+        "completed_at": int(time.time()),
+        "request_counts": {"total": len(output_lines), "completed": len(output_lines), "failed": 0},
+    })
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    state: MockState = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, body: dict, headers: dict = None):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _read_json(self) -> dict:
+        return json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+
+    def _read_multipart(self) -> dict:
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        message = BytesParser(policy=default_policy).parsebytes(
+            f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + body
+        )
+        return {
+            part.get_param("name", header="content-disposition"): (part.get_filename(), part.get_payload(decode=True))
+            for part in message.iter_parts()
+        }
+
+    def do_GET(self):
+        path = self.path.rstrip("/")
+        with self.state.lock:
+            if path.startswith("/v1/files/") and path.endswith("/content"):
+                stored = self.state.files.get(path.split("/")[3])
+                if stored is not None:
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/octet-stream")
+                    self.send_header("Content-Length", str(len(stored["content"])))
+                    self.end_headers()
+                    self.wfile.write(stored["content"])
+                    return
+            elif path.startswith("/v1/batches/"):
+                batch = self.state.batches.get(path.split("/")[3])
+                if batch is not None:
+                    if batch["status"] == "in_progress" and time.time() - batch["created_at"] >= self.state.batch_delay:
+                        run_batch(self.state, batch)
+                    self._send_json(200, batch)
+                    return
+        self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def do_POST(self):
+        if self.path.rstrip("/") == "/v1/files":
+            fields = self._read_multipart()
+            filename, content = fields["file"]
+            purpose = fields["purpose"][1].decode()
+            file_id = f"file-{uuid.uuid4().hex}"
+            stored = {"object": file_object(file_id, filename or "upload.jsonl", content, purpose), "content": content}
+            with self.state.lock:
+                self.state.files[file_id] = stored
+            self._send_json(200, stored["object"])
+        elif self.path.rstrip("/") == "/v1/batches":
+            request = self._read_json()
+            batch_id = f"batch_{uuid.uuid4().hex}"
+            batch = {
+                "id": batch_id,
+                "object": "batch",
+                "endpoint": request["endpoint"],
+                "input_file_id": request["input_file_id"],
+                "completion_window": request["completion_window"],
+                "status": "in_progress",
+                "created_at": int(time.time()),
+                "output_file_id": None,
+                "error_file_id": None,
+                "metadata": request.get("metadata"),
+                "request_counts": {"total": 0, "completed": 0, "failed": 0},
+            }
+            with self.state.lock:
+                self.state.batches[batch_id] = batch
+            self._send_json(200, batch)
+        elif self.path.rstrip("/").endswith("/chat/completions"):
+            request = self._read_json()
+            tokens = estimate_request_tokens(request)
+            admitted, headers = self.state.admit(tokens)
+            if not admitted:
+                error = {"message": "Rate limit reached.", "type": "requests", "code": "rate_limit_exceeded"}
+                self._send_json(429, {"error": error}, headers)
+                return
+            time.sleep(self.state.latency)
+            with self.state.lock:
+                cached_tokens = cached_prefix_tokens(request, self.state.prompt_prefixes)
+            completion = chat_completion(request, count_prompt_tokens(request), self.state.malformed_rate, cached_tokens)
+            self._send_json(200, completion, headers)
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+
+def serve(port: int = 0, rpm: int = 600, tpm: int = 60000, latency: float = 0.2, batch_delay: float = 0.0,
+          background: bool = True, malformed_rate: float = 0.0):
+    """
+    Start a mock server on localhost and return it; its URL is `server.base_url`.
+    """
+    handler = type("BoundMockHandler", (MockHandler,), {"state": MockState(rpm, tpm, latency, batch_delay, malformed_rate)})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    server.state = handler.state
+    server.base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    if background:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local mock of the OpenAI chat completions and batch endpoints.")
+    parser.add_argument("--port", type=int, default=8011)
+    parser.add_argument("--rpm", type=int, default=600, help="Requests per minute before answering 429")
+    parser.add_argument("--tpm", type=int, default=60000, help="Tokens per minute before answering 429")
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds to wait before each reply")
+    parser.add_argument("--batch-delay", type=float, default=5.0, help="Seconds before a submitted batch completes")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="Share of grading replies that ignore the format")
+    args = parser.parse_args()
+    server = serve(args.port, args.rpm, args.tpm, args.latency, args.batch_delay, background=False,
+                   malformed_rate=args.malformed_rate)
+    print(f"Mock OpenAI server listening on {server.base_url}")
+    server.serve_forever()
@@ -0,0 +1,53 @@
+"""
+Parsing of judge replies into Criteria, Supporting Evidence and Score.
+"""
+import re
+
+RESULT_FIELDS = ("Score", "Criteria", "Supporting Evidence")
+
+
+class MalformedReply(ValueError):
+    """
+    A judge reply that does not have the expected format.
+    """
+
+
+def parse_numbered_response(response_content: str) -> dict:
+    """
+    Parse a "1. Criteria / 2. Supporting Evidence / 3. Score" reply.
+
+    Sections that cannot be found are reported as "Not available".
+    """
+    criteria_match = re.search(r"1\.\s*Criteria:\s*(.*?)(?=\n2\.)", response_content, re.S)
+    evidence_match = re.search(r"2\.\s*Supporting Evidence:\s*(.*?)(?=\n3\.)", response_content, re.S)
+    score_match = re.search(r"3\.\s*Score:\s*(.*)", response_content)
+
+    return {
+        "Score": score_match.group(1).strip() if score_match else "Not available",
+        "Criteria": criteria_match.group(1).strip() if criteria_match else "Not available",
+        "Supporting Evidence": evidence_match.group(1).strip() if evidence_match else "Not available"
+    }
+
+
+def parse_prefixed_response(response_content: str) -> dict:
+    """
+    Parse a reply with "Criteria:", "Supporting Evidence:" and "Score:" sections.
+
+    A section runs until the next prefix, so it may span several lines.
+    Raises MalformedReply if any of the three fields is missing.
+    """
+    sections = dict.fromkeys(RESULT_FIELDS)
+    field = None
+    for line in response_content.split("\n"):
+        stripped = line.strip().lstrip("*#- ").replace("**", "")
+        prefix = next((name for name in RESULT_FIELDS if stripped.startswith(f"{name}:")), None)
+        if prefix is not None:
+            field = prefix
+            sections[field] = [stripped[len(prefix) + 1:].strip()]
+        elif field is not None:
+            sections[field].append(line.strip())
+
+    parsed = {name: "\n".join(lines).strip() if lines else "" for name, lines in sections.items()}
+    if not all(parsed.values()):
+        raise MalformedReply("Response does not contain the required structured fields.")
+    return parsed
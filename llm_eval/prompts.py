@@ -0,0 +1,207 @@
+"""
+Default system prompts and the judge requests built for each evaluation path.
+
+Requests put everything that is the same for every row of a metric (the
+system prompt and the reply format) in the system message, ahead of the
+row's data in the user message, so the provider can serve that prefix
+from its prompt cache.
+"""
+from llm_eval.providers import split_judge
+from llm_eval.structured import STRUCTURED_INSTRUCTIONS, grade_format, with_format
+from llm_eval.tokens import DEFAULT_COMPLETION_TOKENS, count_prompt_tokens, split_tokens, truncate_tokens
+
+RELEVANCE_PROMPT = """You are a RELEVANCE grader; providing the relevance of the given question to the given answer.
+Respond only as a number from 0 to 10 where 0 is the least relevant and 10 is the most relevant.
+
+A few additional scoring guidelines:
+- Long answer should score equally well as short answer.
+- RELEVANCE score should increase as the answer provides more RELEVANT context to the question.
+- RELEVANCE score should increase as the answer provides RELEVANT context to more parts of the question.
+- Answer that is RELEVANT to some of the question should score of 2, 3, or 4. Higher score indicates more RELEVANCE.
+- Answer that is RELEVANT to most of the question should get a score of 5, 6, 7, or 8. Higher score indicates more RELEVANCE.
+- Answer that is RELEVANT to the entire question should get a score of 9 or 10. Higher score indicates more RELEVANCE.
+- Answer must be relevant and helpful for answering the entire question to get a score of 10.
+- Never elaborate."""
+
+FACTUAL_ACCURACY_PROMPT = """You are a FACTUAL ACCURACY grader; evaluating the factual correctness of the given answer based on the question and context.
+Respond only as a number from 0 to 10 where 0 indicates completely factually inaccurate and 10 indicates completely factually accurate.
+
+A few additional scoring guidelines:
+- Long answers should score equally well as short answers if they are factually accurate.
+- The FACTUAL ACCURACY score should increase as the answer contains more factually correct information related to the question and context.
+- The presence of minor factual inaccuracies should lead to scores of 2, 3, or 4. Higher scores indicate fewer inaccuracies.
+- If most parts of the answers are factually correct, the score should be 5, 6, 7, or 8. Higher scores indicate greater factual accuracy.
+- If the entire answer is factually accurate and aligned with the question and context, the score should be 9 or 10.
+- The answer must strictly avoid fabrications or contradictions to achieve a score of 10.
+- Never elaborate."""
+
+AGENT_GOAL_ACCURACY_PROMPT = """Role: You are responsible for evaluating the AGENT-GOAL ACCURACY of a conversation based on its alignment with the AGENT PROMPT.
+
+Scoring Scale (0-10):
+0 indicates the responses are entirely unrelated to the AGENT PROMPT.
+1 to 4 reflects limited alignment, lacking depth, precision, or relevance. Scores of 1 to 2 represent negligible coverage with minimal helpfulness, while 3 to 4 indicate partial coverage with insufficient detail or completeness.
+5 to 8 represents reasonable alignment with clear and relevant responses. Scores of 5 to 6 cover most of the prompt but have significant gaps, while 7 to 8 reflect strong alignment with minor omissions or gaps.
+9 to 10 signifies comprehensive alignment with precise, complete, and entirely relevant responses. A score of 9 is near-perfect with minimal imperfections, and a score of 10 is fully sufficient and flawlessly aligned.
+
+Criteria for evaluation include how well the agent responses address user inputs and the AGENT PROMPT, the accuracy, relevance, and helpfulness of the responses, and the completeness and precision in meeting the context of the AGENT PROMPT.
+
+Supporting evidence should highlight areas of strong alignment and fulfillment of goals while identifying specific faults, such as misunderstanding, inaccuracy, or incompleteness, that detract from the relevance or helpfulness of the responses.
+
+Output must be a single numerical score between 0 and 10 with no additional text."""
+
+DEFAULT_MODELS = {"rag": "gpt-4o", "agentic": "gpt-4"}
+
+# Tokens of the metric's system prompt sent to the judge; longer prompts are cut
+MAX_SYSTEM_PROMPT_TOKENS = 500
+
+# Context window of each judge model, the default token budget of a request
+CONTEXT_WINDOWS = {
+    "gpt-4": 8192,
+    "gpt-4-turbo": 128000,
+    "gpt-4o": 128000,
+    "gpt-4o-mini": 128000,
+    "gpt-3.5-turbo": 16385,
+    "llama-3.1-8b-instant": 131072,
+    "llama-3.3-70b-versatile": 131072,
+}
+DEFAULT_CONTEXT_WINDOW = 8192
+# Smallest conversation window, however little room the rest of the prompt leaves
+MIN_WINDOW_TOKENS = 256
+
+
+def context_window(model: str) -> int:
+    return CONTEXT_WINDOWS.get(split_judge(model)[1], DEFAULT_CONTEXT_WINDOW)
+
+
+def default_system_prompt(mode: str, position: int) -> str:
+    """
+    The generated system prompt for the metric at `position` (0-based).
+
+    Question/Context/Answer sheets alternate between relevance and factual
+    accuracy; conversation sheets always grade agent-goal accuracy.
+    """
+    if mode == "agentic":
+        return AGENT_GOAL_ACCURACY_PROMPT
+    return RELEVANCE_PROMPT if position % 2 == 0 else FACTUAL_ACCURACY_PROMPT
+
+
+RAG_FORMAT = """Based on the provided data, evaluate the following in this exact format:
+1. Criteria: [Provide a detailed explanation of how the evaluation is derived.]
+2. Supporting Evidence: [Provide specific examples from the data supporting the evaluation.]
+3. Score: [Provide a numerical or qualitative score.]
+
+Ensure the response strictly follows this format with numbered headings."""
+# Cheap first-pass grades of a cascade (see `cascade`) ask for the score alone
+SCORE_ONLY_INSTRUCTIONS = "Reply with only the numerical score from 0 to 10, without any explanation."
+SCORE_ONLY_MAX_TOKENS = 8
+
+
+def build_rag_request(row, system_prompt: str, selected_columns: list, model: str = DEFAULT_MODELS["rag"],
+                      structured: bool = False, score_only: bool = False) -> dict:
+    """
+    Build the request grading one Question/Context/Answer row on the selected columns.
+
+    A `structured` request asks for a JSON Grade, under a strict schema
+    where the model supports one, instead of numbered headings; a
+    `score_only` request asks for just the score, in a few tokens.
+    """
+    row_data = "".join(f"{col}: {row[col]}\n" for col in selected_columns)
+    if score_only:
+        instructions = f"Based on the provided data, evaluate it. {SCORE_ONLY_INSTRUCTIONS}"
+    elif structured:
+        instructions = f"Based on the provided data, evaluate it. {STRUCTURED_INSTRUCTIONS}"
+    else:
+        instructions = RAG_FORMAT
+    evaluator_prompt = f"""You are an evaluator analyzing the provided data.
+
+{system_prompt}
+
+{instructions}"""
+    request = {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": evaluator_prompt},
+            {"role": "user", "content": f"Below is the data for evaluation:\n{row_data}"}
+        ]
+    }
+    if score_only:
+        request["max_tokens"] = SCORE_ONLY_MAX_TOKENS
+    elif structured:
+        with_format(request, grade_format())
+    return request
+
+
+AGENTIC_INSTRUCTIONS = "Evaluate the conversation for Agent-Goal Accuracy."
+WINDOW_INSTRUCTIONS = (
+    "This is part {part} of {parts} of a longer conversation; the other parts are graded separately, "
+    "so evaluate this part on its own."
+)
+AGENTIC_FORMAT = """Use the following format:
+
+Criteria: [Explain how well the Agent responded to the User's input and fulfilled their goals]
+Supporting Evidence: [Highlight specific faulty or insufficient responses from the Agent]
+Score: [Provide a numerical or qualitative score here]"""
+
+
+def _agentic_request(system_prompt: str, agent_prompt: str, conversation: str, model: str,
+                     part: int = 1, parts: int = 1, structured: bool = False, score_only: bool = False) -> dict:
+    if score_only:
+        instructions = f"{AGENTIC_INSTRUCTIONS} {SCORE_ONLY_INSTRUCTIONS}"
+    else:
+        instructions = f"{AGENTIC_INSTRUCTIONS} {STRUCTURED_INSTRUCTIONS if structured else AGENTIC_FORMAT}"
+    evaluator_prompt = f"""You are an evaluator analyzing agent conversations.
+
+System Prompt: {system_prompt}
+
+{instructions}"""
+    # The agent prompt is often shared between rows, so it comes before the conversation
+    conversation_prompt = f"Agent Prompt: {agent_prompt}\n\n"
+    if parts == 1:
+        conversation_prompt += f"Conversation: {conversation}\n"
+    else:
+        conversation_prompt += (f"Conversation (part {part} of {parts}): {conversation}\n\n"
+                                f"{WINDOW_INSTRUCTIONS.format(part=part, parts=parts)}\n")
+    request = {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": evaluator_prompt},
+            {"role": "user", "content": conversation_prompt}
+        ]
+    }
+    if score_only:
+        request["max_tokens"] = SCORE_ONLY_MAX_TOKENS
+    elif structured:
+        with_format(request, grade_format())
+    return request
+
+
+def build_agentic_requests(row, system_prompt: str, model: str = DEFAULT_MODELS["agentic"],
+                           context_budget: int = None, structured: bool = False, score_only: bool = False) -> list:
+    """
+    Build the requests grading one conversation for agent-goal accuracy.
+
+    The system prompt, conversation and agent prompt are packed into
+    `context_budget` tokens (the model's context window by default), leaving
+    room for the reply. A conversation that does not fit is split between
+    turns into windows, one request each, whose grades are combined later.
+    `structured` requests ask for a JSON Grade under a strict schema and
+    `score_only` requests for just the score.
+    """
+    budget = (context_budget or context_window(model)) - DEFAULT_COMPLETION_TOKENS
+    system_prompt = truncate_tokens(system_prompt, MAX_SYSTEM_PROMPT_TOKENS, model)
+    # The agent prompt is repeated in every window, so it may take at most a quarter of the budget
+    agent_prompt = truncate_tokens(str(row["Agent Prompt"]), budget // 4, model)
+    conversation = str(row["Conversation"])
+
+    request = _agentic_request(system_prompt, agent_prompt, conversation, model, structured=structured,
+                               score_only=score_only)
+    if count_prompt_tokens(request) <= budget:
+        return [request]
+
+    frame = _agentic_request(system_prompt, agent_prompt, "", model, part=99, parts=99, structured=structured,
+                             score_only=score_only)
+    windows = split_tokens(conversation, max(budget - count_prompt_tokens(frame), MIN_WINDOW_TOKENS), model)
+    return [
+        _agentic_request(system_prompt, agent_prompt, window, model, part, len(windows), structured, score_only)
+        for part, window in enumerate(windows, start=1)
+    ]
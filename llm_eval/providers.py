@@ -0,0 +1,140 @@
+"""
+Judge backends.
+
+A metric's judge is written "provider:model", e.g. "groq:llama-3.1-8b-instant";
+a bare model name is an OpenAI model. Every provider is reached through an
+OpenAI-compatible chat completions API, so requests stay plain keyword
+dictionaries and the engine's retries, rate limits and cache apply to all:
+
+- openai: the OpenAI API (OPENAI_API_KEY, or OPENAI_BASE_URL for a proxy)
+- groq: Groq's OpenAI-compatible endpoint (GROQ_API_KEY)
+- local: any OpenAI-compatible local server such as Ollama, vLLM or
+  LM Studio, at LOCAL_JUDGE_BASE_URL
+- mock: an in-process stand-in answering canned grades with no network,
+  after MOCK_JUDGE_LATENCY seconds
+
+The provider prefix is kept in the request's model, so cached responses
+are never shared between providers, and is stripped before sending.
+"""
+import asyncio
+import hashlib
+import json
+import os
+
+import httpx
+import openai
+
+from llm_eval.tokens import count_prompt_tokens
+
+DEFAULT_PROVIDER = "openai"
+
+# Connection settings and the fast model used for cheap calls such as reply repairs
+PROVIDERS = {
+    "openai": {"base_url": None, "api_key_env": "OPENAI_API_KEY", "fast_model": "gpt-4o-mini"},
+    "groq": {"base_url": "https://api.groq.com/openai/v1", "api_key_env": "GROQ_API_KEY",
+             "fast_model": "llama-3.1-8b-instant"},
+    "local": {"base_url": "http://localhost:11434/v1", "base_url_env": "LOCAL_JUDGE_BASE_URL",
+              "api_key_env": "LOCAL_JUDGE_API_KEY", "fast_model": None},
+    "mock": {"base_url": "http://mock.invalid/v1", "api_key_env": None, "fast_model": None},
+}
+
+
+def split_judge(judge: str):
+    """
+    Split a judge into (provider, model); names without a known provider prefix are OpenAI models.
+    """
+    provider, _, model = judge.partition(":")
+    if model and provider in PROVIDERS:
+        return provider, model
+    return DEFAULT_PROVIDER, judge
+
+
+def fast_judge(judge: str) -> str:
+    """
+    The fast model of the judge's provider, or the judge itself when the provider has none.
+    """
+    provider, model = split_judge(judge)
+    fast_model = PROVIDERS[provider]["fast_model"]
+    if fast_model is None:
+        return judge
+    return fast_model if provider == DEFAULT_PROVIDER else f"{provider}:{fast_model}"
+
+
+def mock_client(latency: float = 0.0, malformed_rate: float = 0.0) -> openai.AsyncOpenAI:
+    """
+    An AsyncOpenAI client answered in process by the mock server's canned grades.
+
+    Replies depend only on the request and the system messages it has seen,
+    so runs are reproducible.
+    """
+    from llm_eval.mock_server import cached_prefix_tokens, chat_completion
+
+    prompt_prefixes = set()
+
+    async def handle(request: httpx.Request) -> httpx.Response:
+        if not request.url.path.endswith("/chat/completions"):
+            return httpx.Response(404, json={"error": {"message": f"Unknown path {request.url.path}"}})
+        body = json.loads(request.content)
+        if latency:
+            await asyncio.sleep(latency)
+        cached_tokens = cached_prefix_tokens(body, prompt_prefixes)
+        completion = chat_completion(body, count_prompt_tokens(body), malformed_rate, cached_tokens)
+        completion["id"] = "chatcmpl-mock-" + hashlib.sha256(request.content).hexdigest()[:24]
+        completion["created"] = 0
+        return httpx.Response(200, json=completion)
+
+    return openai.AsyncOpenAI(
+        api_key="mock",
+        base_url=PROVIDERS["mock"]["base_url"],
+        max_retries=0,
+        http_client=httpx.AsyncClient(transport=httpx.MockTransport(handle)),
+    )
+
+
+def make_client(provider: str) -> openai.AsyncOpenAI:
+    """
+    A new async client for `provider`, configured from the environment.
+    """
+    if provider == "mock":
+        return mock_client(float(os.environ.get("MOCK_JUDGE_LATENCY", 0)))
+    settings = PROVIDERS[provider]
+    if provider == DEFAULT_PROVIDER:
+        api_key = openai.api_key
+    else:
+        # Local servers usually accept any key, but the client requires one
+        api_key = os.environ.get(settings["api_key_env"]) or ("local" if provider == "local" else None)
+        if api_key is None:
+            raise ValueError(f"Set {settings['api_key_env']} to grade with {provider} judges.")
+    base_url = settings["base_url"]
+    if settings.get("base_url_env"):
+        base_url = os.environ.get(settings["base_url_env"]) or base_url
+    # Retries are handled by the scheduler so they respect the shared budgets
+    return openai.AsyncOpenAI(api_key=api_key, base_url=base_url, max_retries=0)
+
+
+class JudgeClients:
+    """
+    The async client of each provider a run's requests name, created on first use.
+
+    Clients passed in `clients` (by provider) are used as given and left
+    open; the ones created here are closed by `close`.
+    """
+
+    def __init__(self, clients: dict = None):
+        self.clients = dict(clients or {})
+        self.owned = set()
+
+    def route(self, request: dict):
+        """
+        The client for a request and the request as that provider expects it.
+        """
+        provider, model = split_judge(request["model"])
+        if provider not in self.clients:
+            self.clients[provider] = make_client(provider)
+            self.owned.add(provider)
+        return self.clients[provider], {**request, "model": model}
+
+    async def close(self):
+        for provider in self.owned:
+            await self.clients[provider].close()
+        self.owned.clear()
@@ -0,0 +1,138 @@
+"""
+Columnar store of evaluation results.
+
+Grades are kept as one narrow table (Index, Metric, Selected Columns,
+Score, Score Value, Criteria, Supporting Evidence, Tokens Sent, Parse
+Status, Error) with the free-text Score normalized to a numeric Score
+Value on a 0-10 scale. The row text (Question, Context, ...) is kept
+once per Index in a separate table, and only joined back in for display
+and export.
+"""
+import re
+
+import numpy as np
+import pandas as pd
+
+GRADE_COLUMNS = ["Index", "Metric", "Selected Columns", "Score", "Score Value", "Criteria", "Supporting Evidence", "Tokens Sent", "Parse Status", "Error"]
+DEFAULT_PASS_THRESHOLD = 7.0
+# Parse Status of a result copied from an identical row's grade rather than parsed from a reply of its own
+REUSED = "reused"
+
+SCORE_PATTERN = re.compile(r"(-?\d+(?:\.\d+)?)(?:\s*(?:/|out of)\s*(\d+(?:\.\d+)?))?", re.I)
+
+
+def normalize_score(score) -> float:
+    """
+    Convert a judge's score ("8", "8/10", "4 out of 5", 7.5) to a number on a 0-10 scale.
+
+    Scores without a number ("Not available", "Error", "N/A") become NaN.
+    """
+    if isinstance(score, (int, float)) and not isinstance(score, bool):
+        return float(score)
+    match = SCORE_PATTERN.search(str(score or ""))
+    if match is None:
+        return np.nan
+    value = float(match.group(1))
+    if match.group(2) and float(match.group(2)) > 0:
+        value = value / float(match.group(2)) * 10
+    return value
+
+
+def split_result(result: dict):
+    """
+    Split a wide result row into its row data (text columns keyed by Index) and its grade.
+    """
+    grade = {col: result.get(col) for col in GRADE_COLUMNS}
+    grade["Score Value"] = normalize_score(result.get("Score"))
+    data = {col: value for col, value in result.items() if col not in GRADE_COLUMNS or col == "Index"}
+    return data, grade
+
+
+class ResultStore:
+    """
+    Results held as a grades table plus a row-text table keyed by Index.
+    """
+
+    def __init__(self, grades: pd.DataFrame, rows: pd.DataFrame):
+        self.grades = grades.astype({"Metric": "category", "Selected Columns": "category", "Parse Status": "category", "Score Value": "float64", "Tokens Sent": "Int64"})
+        self.rows = rows
+
+    @classmethod
+    def from_results(cls, results) -> "ResultStore":
+        """
+        Build a store from wide result rows, keeping each Index's text once.
+        """
+        grades, rows = [], {}
+        for result in results:
+            data, grade = split_result(result)
+            grades.append(grade)
+            rows.setdefault(str(data["Index"]), {}).update(data)
+        return cls(pd.DataFrame(grades, columns=GRADE_COLUMNS), pd.DataFrame(list(rows.values())))
+
+    def __len__(self) -> int:
+        return len(self.grades)
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        The wide table shown in the app: each grade joined with its row text.
+        """
+        grades = self.grades.drop(columns=["Error"] if self.grades["Error"].isna().all() else [])
+        if self.rows.empty:
+            return grades
+        rows = self.rows.assign(_key=self.rows["Index"].astype(str)).drop(columns=["Index"])
+        frame = grades.assign(_key=grades["Index"].astype(str)).merge(rows, on="_key", how="left")
+        return frame.drop(columns=["_key"])
+
+    def to_arrow(self):
+        """
+        The wide table as a pyarrow Table, with repeated strings dictionary-encoded.
+        """
+        import pyarrow as pa
+
+        return pa.Table.from_pandas(self.to_frame(), preserve_index=False)
+
+    def to_parquet(self, path: str):
+        self.to_frame().to_parquet(path, index=False)
+
+    def aggregate(self, pass_threshold: float = DEFAULT_PASS_THRESHOLD) -> pd.DataFrame:
+        """
+        Per-metric counts, score statistics, pass rate (share of scored results >= `pass_threshold`) and tokens sent.
+
+        The parse failure rate is the share of replies that did not parse at
+        first, whether or not their repair call fixed them; results reused
+        from an identical row are not replies.
+        """
+        score = self.grades["Score Value"]
+        frame = self.grades.assign(
+            scored=score.notna(),
+            passed=score >= pass_threshold,
+            errors=self.grades["Criteria"].eq("Error"),
+            replies=self.grades["Parse Status"].notna() & self.grades["Parse Status"].ne(REUSED),
+            malformed=self.grades["Parse Status"].isin(["repaired", "failed"]),
+            repaired=self.grades["Parse Status"].eq("repaired"),
+        )
+        summary = frame.groupby("Metric", observed=True).agg(
+            results=("scored", "size"),
+            scored=("scored", "sum"),
+            errors=("errors", "sum"),
+            mean=("Score Value", "mean"),
+            median=("Score Value", "median"),
+            std=("Score Value", "std"),
+            min=("Score Value", "min"),
+            max=("Score Value", "max"),
+            passed=("passed", "sum"),
+            tokens=("Tokens Sent", "sum"),
+            replies=("replies", "sum"),
+            malformed=("malformed", "sum"),
+            repaired=("repaired", "sum"),
+        )
+        summary["pass_rate"] = summary["passed"] / summary["scored"].where(summary["scored"] > 0)
+        summary["parse_failure_rate"] = summary["malformed"] / summary["replies"].where(summary["replies"] > 0)
+        return summary.drop(columns=["passed", "replies", "malformed"])
+
+    def distribution(self) -> pd.DataFrame:
+        """
+        Number of results per metric at each whole score.
+        """
+        scored = self.grades.dropna(subset=["Score Value"])
+        return pd.crosstab(scored["Metric"], scored["Score Value"].round().astype(int))
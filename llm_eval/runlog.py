@@ -0,0 +1,246 @@
+"""
+Durable, resumable log of evaluation runs.
+
+Every result row is appended to a SQLite run log as soon as it is graded,
+so a run that dies halfway keeps what it paid for. Restarting with the
+same run ID skips the (Index, Metric) pairs already graded; rows whose
+grade failed are retried, and the retried grade replaces the failed one.
+
+Each grade is logged with a fingerprint of what it depends on: the sheet's
+content and the metric's settings (see `grading_fingerprints`). A pair only
+counts as graded under the same fingerprint, so changing a metric's prompt,
+columns or judge, or grading a different sheet under the run ID, grades
+the rows again.
+
+Results are stored columnar: a row's text once per Index in `row_data`,
+and one narrow `grades` row per (Index, Metric) with the numeric score.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+import pandas as pd
+
+from llm_eval.cache import request_key
+from llm_eval.results import GRADE_COLUMNS, ResultStore, split_result
+
+DEFAULT_RUNLOG_PATH = os.path.join(".llm_eval", "runs.sqlite")
+
+# SQL column for each grade column
+GRADE_FIELDS = {
+    "Metric": "metric",
+    "Selected Columns": "selected_columns",
+    "Score": "score",
+    "Score Value": "score_value",
+    "Criteria": "criteria",
+    "Supporting Evidence": "evidence",
+    "Tokens Sent": "tokens_sent",
+    "Parse Status": "parse_status",
+    "Error": "error",
+}
+
+# Grade columns added since the first run logs, with their SQL types
+ADDED_GRADE_COLUMNS = {"tokens_sent": "INTEGER", "parse_status": "TEXT", "fingerprint": "TEXT"}
+
+
+def new_run_id() -> str:
+    return time.strftime("%Y%m%d-%H%M%S-") + uuid.uuid4().hex[:6]
+
+
+def grading_fingerprints(sheet_digest: str, metrics: list, structured: bool = False, fused: bool = False) -> dict:
+    """
+    Each metric's name mapped to a hash of the sheet digest and the settings its grades depend on.
+
+    A fused grade depends on every metric in the shared request.
+    """
+    if fused:
+        fingerprint = request_key({"sheet": sheet_digest, "metrics": metrics, "structured": structured, "fused": True})
+        return {metric["name"]: fingerprint for metric in metrics}
+    return {
+        metric["name"]: request_key({"sheet": sheet_digest, "metric": metric, "structured": structured})
+        for metric in metrics
+    }
+
+
+def _json_default(value):
+    # numpy scalars and timestamps from sheet cells
+    return value.item() if hasattr(value, "item") else str(value)
+
+
+class RunLog:
+    """
+    Store of result rows grouped by run ID, one per (Index, Metric).
+    """
+
+    def __init__(self, path: str = DEFAULT_RUNLOG_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS runs (run_id TEXT PRIMARY KEY, created_at REAL NOT NULL, description TEXT)"
+            )
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS row_data ("
+                "run_id TEXT NOT NULL, row_index TEXT NOT NULL, data TEXT NOT NULL, PRIMARY KEY (run_id, row_index))"
+            )
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS grades ("
+                "run_id TEXT NOT NULL, row_index TEXT NOT NULL, metric TEXT NOT NULL, selected_columns TEXT, "
+                "score TEXT, score_value REAL, criteria TEXT, evidence TEXT, tokens_sent INTEGER, parse_status TEXT, error TEXT, "
+                "fingerprint TEXT, "
+                "PRIMARY KEY (run_id, row_index, metric))"
+            )
+            # Logs written before these columns were recorded
+            grade_columns = {row[1] for row in self.connection.execute("PRAGMA table_info(grades)")}
+            for column, column_type in ADDED_GRADE_COLUMNS.items():
+                if column not in grade_columns:
+                    self.connection.execute(f"ALTER TABLE grades ADD COLUMN {column} {column_type}")
+
+    def start(self, run_id: str = None, description: str = "") -> str:
+        """
+        Register a run, or continue an existing one with the same ID; returns the run ID.
+        """
+        run_id = run_id or new_run_id()
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR IGNORE INTO runs (run_id, created_at, description) VALUES (?, ?, ?)",
+                (run_id, time.time(), description),
+            )
+        return run_id
+
+    def runs(self) -> list:
+        """
+        Every run with its result count, newest first.
+        """
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT runs.run_id, runs.created_at, runs.description, COUNT(grades.run_id) FROM runs "
+                "LEFT JOIN grades ON grades.run_id = runs.run_id GROUP BY runs.run_id ORDER BY runs.created_at DESC"
+            ).fetchall()
+        return [{"run_id": r[0], "created_at": r[1], "description": r[2], "results": r[3]} for r in rows]
+
+    def done(self, run_id: str, fingerprints: dict = None) -> set:
+        """
+        The (Index, Metric) pairs already graded in a run, leaving out failed grades so they are retried.
+
+        A grade failed, as in `evaluate.failed`, when it records an error or
+        a reply that could not be parsed.
+
+        With `fingerprints` (see `grading_fingerprints`), only grades logged
+        under their metric's current fingerprint count. Index values are
+        compared as strings.
+        """
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT row_index, metric, fingerprint FROM grades "
+                "WHERE run_id = ? AND criteria IS NOT 'Error' AND error IS NULL AND parse_status IS NOT 'failed'",
+                (run_id,),
+            ).fetchall()
+        return {
+            (row_index, metric) for row_index, metric, fingerprint in rows
+            if fingerprints is None or fingerprints.get(metric) == fingerprint
+        }
+
+    def _put_row(self, run_id: str, row_index: str, data: dict):
+        # Later metrics may have loaded more columns of the same row
+        existing = self.connection.execute(
+            "SELECT data FROM row_data WHERE run_id = ? AND row_index = ?", (run_id, row_index)
+        ).fetchone()
+        if existing is None or not set(data) <= set(json.loads(existing[0])):
+            merged = {**(json.loads(existing[0]) if existing else {}), **data}
+            self.connection.execute(
+                "INSERT OR REPLACE INTO row_data (run_id, row_index, data) VALUES (?, ?, ?)",
+                (run_id, row_index, json.dumps(merged, ensure_ascii=False, default=_json_default)),
+            )
+
+    def add_rows(self, run_id: str, rows: list):
+        """
+        Log the text of rows under a run before they are graded, e.g. by a batch job.
+        """
+        with self.lock, self.connection:
+            for row in rows:
+                self._put_row(run_id, str(row["Index"]), row)
+
+    def row_data(self, run_id: str) -> dict:
+        """
+        The text of every row logged in a run, by Index as a string.
+        """
+        with self.lock:
+            rows = self.connection.execute("SELECT row_index, data FROM row_data WHERE run_id = ?", (run_id,)).fetchall()
+        return {row_index: json.loads(data) for row_index, data in rows}
+
+    def append(self, run_id: str, result: dict, fingerprint: str = None):
+        data, grade = split_result(result)
+        row_index = str(result["Index"])
+        with self.lock, self.connection:
+            self._put_row(run_id, row_index, data)
+            # A retried grade replaces the failed one
+            self.connection.execute(
+                f"INSERT OR REPLACE INTO grades (run_id, row_index, {', '.join(GRADE_FIELDS.values())}, fingerprint) "
+                f"VALUES (?, ?, {', '.join('?' * len(GRADE_FIELDS))}, ?)",
+                (run_id, row_index, *(grade[col] for col in GRADE_FIELDS), fingerprint),
+            )
+
+    def record(self, run_id: str, results, fingerprints: dict = None):
+        """
+        Pass result rows through, appending each to the run as it arrives under its metric's fingerprint.
+        """
+        fingerprints = fingerprints or {}
+        for result in results:
+            self.append(run_id, result, fingerprints.get(result["Metric"]))
+            yield result
+
+    def _grades_query(self, columns: str, run_id: str, metric: str = None):
+        query = f"SELECT {columns} FROM grades JOIN row_data USING (run_id, row_index) WHERE run_id = ?"
+        params = [run_id]
+        if metric is not None:
+            query += " AND metric = ?"
+            params.append(metric)
+        return query + " ORDER BY grades.rowid", params
+
+    def store(self, run_id: str, metric: str = None) -> ResultStore:
+        """
+        Load a run's results, optionally for one metric, into a columnar ResultStore.
+        """
+        query, params = self._grades_query(f"row_index, {', '.join(GRADE_FIELDS.values())}", run_id, metric)
+        with self.lock:
+            grades = pd.read_sql_query(query, self.connection, params=params)
+            data = self.connection.execute("SELECT row_index, data FROM row_data WHERE run_id = ?", (run_id,)).fetchall()
+        grades.columns = ["row_index", *GRADE_FIELDS]
+        rows = {row_index: json.loads(row) for row_index, row in data}
+        grades.insert(0, "Index", grades["row_index"].map(lambda row_index: rows[row_index]["Index"]))
+        used = grades["row_index"].unique()
+        return ResultStore(grades.drop(columns=["row_index"])[GRADE_COLUMNS], pd.DataFrame([rows[key] for key in used]))
+
+    def results(self, run_id: str, metric: str = None):
+        """
+        Yield a run's result rows in the order they were logged, optionally for one metric.
+        """
+        query, params = self._grades_query(f"{', '.join(GRADE_FIELDS.values())}, data", run_id, metric)
+        with self.lock:
+            rows = self.connection.execute(query, params).fetchall()
+        for *grade, data in rows:
+            grade = dict(zip(GRADE_FIELDS, grade))
+            data = json.loads(data)
+            result = {
+                "Index": data["Index"],
+                "Metric": grade["Metric"],
+                "Selected Columns": grade["Selected Columns"],
+                "Score": grade["Score"],
+                "Criteria": grade["Criteria"],
+                "Supporting Evidence": grade["Supporting Evidence"],
+                "Tokens Sent": grade["Tokens Sent"],
+                "Parse Status": grade["Parse Status"],
+                **data
+            }
+            if grade["Error"] is not None:
+                result["Error"] = grade["Error"]
+            yield result
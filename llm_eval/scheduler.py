@@ -0,0 +1,218 @@
+"""
+Rate-limit-aware dispatch of chat completion requests.
+
+Every call first reserves its estimated tokens from requests-per-minute and
+tokens-per-minute budgets, keeps the budgets in step with the rate-limit
+headers the API returns, and is retried with jittered exponential backoff
+on rate limits, timeouts and transient server errors.
+
+The budgets' rates are the configured ones, lowered to the limits the API
+reports. A 429 halves them, at most once per BACKOFF_COOLDOWN seconds so
+a burst of rejected calls counts once, and they win back RECOVERY_RATE of
+the full rates per second.
+"""
+import asyncio
+import re
+import time
+
+import httpx
+import openai
+from openai.types.chat import ChatCompletion
+from tenacity import AsyncRetrying, retry_if_exception, stop_after_attempt, wait_random_exponential
+
+from llm_eval.tokens import estimate_request_tokens
+
+DEFAULT_RPM = 500
+DEFAULT_TPM = 30000
+DEFAULT_MAX_ATTEMPTS = 6
+
+# Backoff of the rates after a 429 and their recovery per second, as shares of the full rates
+BACKOFF_FACTOR = 0.5
+BACKOFF_COOLDOWN = 1.0
+MIN_RATE_SHARE = 0.05
+RECOVERY_RATE = 1 / 60
+# Longest sleep before a waiting request checks the budgets again, as they may change meanwhile
+MAX_WAIT = 1.0
+
+DURATION_PATTERN = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_duration(value: str) -> float:
+    """
+    Convert a rate-limit reset value such as "6m0s", "1.5s" or "20ms" to seconds.
+    """
+    try:
+        return float(value)
+    except ValueError:
+        return sum(float(amount) * DURATION_UNITS[unit] for amount, unit in DURATION_PATTERN.findall(value))
+
+
+def retry_after(headers) -> float:
+    """
+    Seconds the API asked us to wait before the next request, or 0 if it did not say.
+    """
+    if headers.get("retry-after-ms"):
+        return float(headers["retry-after-ms"]) / 1000
+    for name in ("retry-after", "x-ratelimit-reset-requests", "x-ratelimit-reset-tokens"):
+        if headers.get(name):
+            return parse_duration(headers[name])
+    return 0.0
+
+
+class RateLimiter:
+    """
+    Token buckets metering requests per minute and tokens per minute.
+    """
+
+    def __init__(self, rpm: int = DEFAULT_RPM, tpm: int = DEFAULT_TPM):
+        self.configured_rpm = rpm
+        self.configured_tpm = tpm
+        # The configured rates, lowered to the limits the API reports
+        self.limit_rpm = rpm
+        self.limit_tpm = tpm
+        # Share of those limits in use, lowered after 429s
+        self.share = 1.0
+        self.rpm = rpm
+        self.tpm = tpm
+        self.available_requests = float(rpm)
+        self.available_tokens = float(tpm)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.backed_off = float("-inf")
+        self.lock = asyncio.Lock()
+
+    def _scale(self):
+        self.rpm = self.limit_rpm * self.share
+        self.tpm = self.limit_tpm * self.share
+
+    def _set_rates(self):
+        self._refill()
+        self._scale()
+        self.available_requests = min(self.available_requests, self.rpm)
+        self.available_tokens = min(self.available_tokens, self.tpm)
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self.updated
+        self.updated = now
+        if self.share < 1.0:
+            # Rates lost to 429s come back over time, with the headroom they add, so a
+            # reservation of the whole budget is not outrun by the budget growing
+            share = min(1.0, self.share + elapsed * RECOVERY_RATE)
+            self.available_requests += (share - self.share) * self.limit_rpm
+            self.available_tokens += (share - self.share) * self.limit_tpm
+            self.share = share
+            self._scale()
+        self.available_requests = min(self.rpm, self.available_requests + elapsed * self.rpm / 60)
+        self.available_tokens = min(self.tpm, self.available_tokens + elapsed * self.tpm / 60)
+
+    async def acquire(self, tokens: int):
+        """
+        Wait until one request and `tokens` tokens fit in the budgets, then reserve them.
+
+        The budgets are checked under the lock but waited for outside it, so
+        requests that fit go ahead of one still waiting.
+        """
+        while True:
+            async with self.lock:
+                self._refill()
+                # A single prompt larger than the whole budget, which 429s and
+                # rate-limit headers may shrink meanwhile, still has to be sent eventually
+                needed = min(tokens, self.tpm)
+                wait = self.paused_until - time.monotonic()
+                if wait <= 0 and self.available_requests >= 1 and self.available_tokens >= needed:
+                    self.available_requests -= 1
+                    self.available_tokens -= needed
+                    return
+                wait = max(
+                    wait,
+                    (1 - self.available_requests) * 60 / self.rpm,
+                    (needed - self.available_tokens) * 60 / self.tpm,
+                )
+            await asyncio.sleep(min(wait, MAX_WAIT))
+
+    def settle(self, reserved: int, used: int):
+        """
+        Return the unused part of a reservation once the actual usage is known.
+        """
+        self._refill()
+        self.available_tokens = min(self.tpm, self.available_tokens + reserved - used)
+
+    def observe(self, headers):
+        """
+        Never assume more headroom or higher limits than the API reports in its rate-limit headers.
+        """
+        limit_requests = headers.get("x-ratelimit-limit-requests")
+        limit_tokens = headers.get("x-ratelimit-limit-tokens")
+        if limit_requests is not None or limit_tokens is not None:
+            if limit_requests is not None:
+                self.limit_rpm = min(self.configured_rpm, float(limit_requests))
+            if limit_tokens is not None:
+                self.limit_tpm = min(self.configured_tpm, float(limit_tokens))
+            self._set_rates()
+        self._refill()
+        remaining_requests = headers.get("x-ratelimit-remaining-requests")
+        remaining_tokens = headers.get("x-ratelimit-remaining-tokens")
+        if remaining_requests is not None:
+            self.available_requests = min(self.available_requests, float(remaining_requests))
+        if remaining_tokens is not None:
+            self.available_tokens = min(self.available_tokens, float(remaining_tokens))
+
+    def pause(self, seconds: float):
+        """
+        Hold back every request for `seconds`, e.g. after the API answered 429.
+        """
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def back_off(self, seconds: float):
+        """
+        Pause for `seconds` after a 429 and, unless another 429 just did, halve the rates.
+        """
+        now = time.monotonic()
+        if now - self.backed_off >= BACKOFF_COOLDOWN:
+            self.backed_off = now
+            self.share = max(MIN_RATE_SHARE, self.share * BACKOFF_FACTOR)
+            self._set_rates()
+        self.pause(seconds)
+
+
+def _is_retryable(error: BaseException) -> bool:
+    if isinstance(error, openai.RateLimitError):
+        # An exhausted quota will not recover by waiting
+        return "insufficient_quota" not in str(error)
+    return isinstance(error, (openai.APITimeoutError, openai.APIConnectionError, openai.InternalServerError, TimeoutError))
+
+
+async def complete(client, request: dict, limiter: RateLimiter = None, timeout: float = 60.0,
+                   max_attempts: int = DEFAULT_MAX_ATTEMPTS):
+    """
+    Send one chat completion request under the rate limiter, retrying transient failures.
+    """
+    reserved = estimate_request_tokens(request)
+    async for attempt in AsyncRetrying(
+        retry=retry_if_exception(_is_retryable),
+        wait=wait_random_exponential(multiplier=0.5, max=60),
+        stop=stop_after_attempt(max_attempts),
+        reraise=True,
+    ):
+        with attempt:
+            if limiter is not None:
+                await limiter.acquire(reserved)
+            try:
+                # Requests are already plain JSON, so they are posted as they are: the typed
+                # create() re-derives its parameter type hints on every call (about 12 ms of CPU)
+                raw = await asyncio.wait_for(client.post("/chat/completions", cast_to=httpx.Response, body=request), timeout)
+            except asyncio.TimeoutError:
+                raise TimeoutError(f"Request timed out after {timeout} seconds.")
+            except openai.RateLimitError as e:
+                if limiter is not None:
+                    limiter.observe(e.response.headers)
+                    limiter.back_off(retry_after(e.response.headers))
+                raise
+            completion = ChatCompletion.model_validate(raw.json())
+            if limiter is not None:
+                limiter.observe(raw.headers)
+                if completion.usage is not None:
+                    limiter.settle(reserved, completion.usage.total_tokens)
+            return completion
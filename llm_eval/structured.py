@@ -0,0 +1,159 @@
+"""
+Structured-output grading: judge replies constrained to a JSON schema.
+
+In structured mode every request carries a strict `json_schema` response
+format, so the reply parses into a typed Grade instead of being scraped
+for numbered headings or line prefixes. Judge models without schema
+support get the plain JSON object format instead, or no response format
+at all when they have no JSON mode either (see `supported_format`); the
+prompt still asks for the JSON Grade. A reply that still cannot be
+parsed, in any mode, gets one repair call: the fast model of the judge's
+provider rewrites just that reply into the schema, without resending the
+row.
+"""
+import json
+from dataclasses import dataclass
+
+from llm_eval.parsing import RESULT_FIELDS, MalformedReply
+from llm_eval.providers import split_judge
+
+REPAIR_MAX_TOKENS = 1000
+
+JSON_OBJECT_FORMAT = {"type": "json_object"}
+# Model name prefixes, by provider, of judges accepting a strict json_schema response format
+SCHEMA_MODELS = {"openai": ("gpt-4o", "gpt-4.1", "gpt-5", "o1", "o3", "o4"), "mock": ("",)}
+# and of judges accepting only the json_object format; Groq and local servers have a JSON mode for every model
+JSON_MODE_MODELS = {"openai": ("gpt-4-turbo", "gpt-4-1106", "gpt-4-0125", "gpt-3.5-turbo"), "groq": ("",), "local": ("",)}
+
+GRADE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "Criteria": {"type": "string", "description": "A detailed explanation of how the evaluation is derived."},
+        "Supporting Evidence": {"type": "string", "description": "Specific examples from the data supporting the evaluation."},
+        "Score": {"type": "number", "description": "The numerical score."},
+    },
+    "required": ["Criteria", "Supporting Evidence", "Score"],
+    "additionalProperties": False,
+}
+
+STRUCTURED_INSTRUCTIONS = (
+    'Respond with a JSON object with the keys "Criteria" (a detailed explanation of how the evaluation is derived), '
+    '"Supporting Evidence" (specific examples from the data supporting the evaluation) and "Score" (a number).'
+)
+
+
+@dataclass(frozen=True)
+class Grade:
+    """
+    One metric's grade of one row.
+    """
+    score: float
+    criteria: str
+    evidence: str
+
+    def fields(self) -> dict:
+        """
+        The grade as result row fields.
+        """
+        return {"Score": f"{self.score:g}", "Criteria": self.criteria, "Supporting Evidence": self.evidence}
+
+
+def grade_format() -> dict:
+    """
+    The response format constraining a reply to one Grade.
+    """
+    return {"type": "json_schema", "json_schema": {"name": "grade", "strict": True, "schema": GRADE_SCHEMA}}
+
+
+def fused_format(metrics: list) -> dict:
+    """
+    The response format constraining a fused reply to one Grade per metric, keyed by metric name.
+    """
+    names = [metric["name"] for metric in metrics]
+    schema = {
+        "type": "object",
+        "properties": {name: GRADE_SCHEMA for name in names},
+        "required": names,
+        "additionalProperties": False,
+    }
+    return {"type": "json_schema", "json_schema": {"name": "grades", "strict": True, "schema": schema}}
+
+
+def supported_format(model: str, response_format: dict):
+    """
+    `response_format` if the judge `model` accepts it, else the JSON object format if it has a JSON mode, else None.
+
+    Without a response format only the prompt's instructions and the
+    repair pass hold the reply to JSON.
+    """
+    provider, name = split_judge(model)
+    if name.startswith(SCHEMA_MODELS.get(provider, ())):
+        return response_format
+    if name.startswith(JSON_MODE_MODELS.get(provider, ())):
+        return JSON_OBJECT_FORMAT
+    return None
+
+
+def with_format(request: dict, response_format: dict) -> dict:
+    """
+    Set the request's response format to the one its model supports of `response_format`, if any.
+    """
+    response_format = supported_format(request["model"], response_format)
+    if response_format is not None:
+        request["response_format"] = response_format
+    return request
+
+
+def to_grade(entry) -> Grade:
+    """
+    Check one decoded JSON grade against the schema.
+    """
+    if not isinstance(entry, dict):
+        raise MalformedReply("Grade is not a JSON object.")
+    missing = [field for field in RESULT_FIELDS if field not in entry]
+    if missing:
+        raise MalformedReply(f"Grade is missing {', '.join(missing)}.")
+    try:
+        score = float(entry["Score"])
+    except (TypeError, ValueError):
+        raise MalformedReply(f"Score is not a number: {entry['Score']!r}.") from None
+    return Grade(score, str(entry["Criteria"]).strip(), str(entry["Supporting Evidence"]).strip())
+
+
+def parse_grade(response_content: str) -> Grade:
+    """
+    Parse a structured reply into a Grade, raising MalformedReply if it does not match the schema.
+    """
+    try:
+        data = json.loads(response_content)
+    except json.JSONDecodeError as e:
+        raise MalformedReply(f"Response is not valid JSON: {e}") from None
+    return to_grade(data)
+
+
+def build_repair_request(response_content: str, response_format: dict, problem: str, model: str) -> dict:
+    """
+    Build the request asking `model`, usually a fast one, to rewrite a malformed reply into `response_format`.
+
+    Only the reply is sent, not the row it graded. Models without schema
+    support are given the schema in the prompt instead.
+    """
+    schema = ""
+    if supported_format(model, response_format) is not response_format and "json_schema" in response_format:
+        schema = f"Schema:\n{json.dumps(response_format['json_schema']['schema'])}\n\n"
+    repair_prompt = f"""The evaluation below could not be read: {problem}
+
+Rewrite it as JSON matching the required schema. Copy the criteria, supporting evidence and score from the evaluation; do not evaluate anything again. If the score is qualitative, convert it to a number from 0 to 10.
+
+{schema}Evaluation:
+{response_content}
+"""
+    request = {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": "You convert evaluation replies into JSON."},
+            {"role": "user", "content": repair_prompt}
+        ],
+        "max_tokens": REPAIR_MAX_TOKENS
+    }
+    return with_format(request, response_format)
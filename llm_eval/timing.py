@@ -0,0 +1,153 @@
+"""
+Throughput and per-stage timing of an evaluation run.
+
+A run's wall time is split between the stages a row passes through, each
+timed exclusively (time spent in a stage nested inside another is counted
+only once, for the inner stage):
+
+- file parsing: reading rows from the sheet
+- prompt construction: building the judge requests
+- API round-trip: waiting on the judge, including the client's own work
+- response parsing: turning replies into result rows
+- rendering: drawing the live table in the app
+
+Judge calls are also timed one by one, from sending to the reply, for
+latency percentiles; cached responses are not calls. Their usage gives
+the prompt tokens the provider served from its prompt cache. Cascaded
+metrics (see `cascade`) count the full-judge requests their cheap pass
+saved and, net of the cheap calls themselves, the change in calls and
+prompt tokens against grading every row in full. Rows identical to an
+earlier row count the requests and tokens their reused grade saved.
+"""
+import collections
+import time
+from contextlib import contextmanager
+
+FILE_PARSING = "file parsing"
+PROMPT_CONSTRUCTION = "prompt construction"
+API_ROUND_TRIP = "API round-trip"
+RESPONSE_PARSING = "response parsing"
+RENDERING = "rendering"
+STAGES = (FILE_PARSING, PROMPT_CONSTRUCTION, API_ROUND_TRIP, RESPONSE_PARSING, RENDERING)
+
+
+def percentile(ordered: list, share: float) -> float:
+    """
+    The nearest-rank percentile of a non-empty ascending list.
+    """
+    return ordered[min(len(ordered) - 1, max(0, round(share * len(ordered)) - 1))]
+
+
+class RunStats:
+    """
+    Counters and timers filled in while a run streams, readable at any point.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = dict.fromkeys(STAGES, 0.0)
+        self.latencies = []
+        self.tokens = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.rows = 0
+        self.results = 0
+        # rows, cheap requests and their prompt tokens, full requests sent and needed without the cascade,
+        # prompt tokens of the full requests not sent, escalated, sampled, agreed
+        self.cascade = collections.Counter()
+        # rows graded by reusing an identical row's grade, and the requests and tokens that saved
+        self.duplicates = collections.Counter()
+        self._open = []
+        self._mark = self.started
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Time the block as `name`, pausing the stage it is nested in.
+        """
+        now = time.perf_counter()
+        if self._open:
+            self.stages[self._open[-1]] += now - self._mark
+        self._open.append(name)
+        self._mark = now
+        try:
+            yield
+        finally:
+            now = time.perf_counter()
+            self.stages[self._open.pop()] += now - self._mark
+            self._mark = now
+
+    def timed(self, name: str, iterable):
+        """
+        Iterate `iterable`, timing the production of each item as `name`.
+        """
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def call(self, latency: float, usage=None):
+        """
+        Record one judge call that took `latency` seconds, with the usage its completion reported.
+        """
+        self.latencies.append(latency)
+        if usage is None:
+            return
+        self.tokens += usage.total_tokens or 0
+        self.prompt_tokens += usage.prompt_tokens or 0
+        details = getattr(usage, "prompt_tokens_details", None)
+        if details is not None:
+            self.cached_tokens += details.cached_tokens or 0
+
+    def summary(self) -> dict:
+        """
+        Throughput, call latency percentiles in milliseconds (None before any call) and seconds per stage so far.
+
+        The share of prompt tokens served from the provider's prompt cache
+        and the savings of reused duplicate grades are included. Runs with
+        cascaded metrics also report the share of full-judge requests saved,
+        the net change in calls and prompt tokens once the cheap calls are
+        counted (negative when the cascade saved) and the agreement rate of
+        the spot-checked rows.
+        """
+        elapsed = time.perf_counter() - self.started
+        ordered = sorted(self.latencies)
+        stages = {name: round(seconds, 3) for name, seconds in self.stages.items()}
+        stages["other"] = round(max(0.0, elapsed - sum(self.stages.values())), 3)
+        summary = {
+            "elapsed_s": round(elapsed, 3),
+            "rows": self.rows,
+            "results": self.results,
+            "calls": len(ordered),
+            "rows_per_s": round(self.rows / elapsed, 1) if elapsed else 0.0,
+            "tokens": self.tokens,
+            "tokens_per_s": round(self.tokens / elapsed, 1) if elapsed else 0.0,
+            **{f"p{share}_ms": round(percentile(ordered, share / 100) * 1000, 1) if ordered else None
+               for share in (50, 95, 99)},
+            "stages_s": stages,
+            "prompt_tokens": self.prompt_tokens,
+            "cached_prompt_tokens": self.cached_tokens,
+            "prompt_cache_rate": round(self.cached_tokens / self.prompt_tokens, 3) if self.prompt_tokens else 0.0,
+            "duplicates": {
+                "rows": self.duplicates["rows"],
+                "requests_saved": self.duplicates["requests"],
+                "tokens_saved": self.duplicates["tokens"],
+            },
+        }
+        cascade = self.cascade
+        if cascade["rows"]:
+            summary["cascade"] = {
+                "rows": cascade["rows"],
+                "escalated": cascade["escalated"],
+                "cheap_requests": cascade["cheap_requests"],
+                "full_requests_saved": round(1 - cascade["full_requests_sent"] / cascade["full_requests"], 3),
+                "net_calls": cascade["cheap_requests"] + cascade["full_requests_sent"] - cascade["full_requests"],
+                "net_tokens": cascade["cheap_tokens"] - cascade["full_tokens_saved"],
+                "sampled": cascade["sampled"],
+                "agreement_rate": round(cascade["agreed"] / cascade["sampled"], 3) if cascade["sampled"] else None,
+            }
+        return summary
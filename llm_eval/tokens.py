@@ -0,0 +1,96 @@
+"""
+Token estimates for prompts, using tiktoken when its encodings are available.
+"""
+import functools
+
+import tiktoken
+
+# Tokens reserved for the reply when a request does not set max_tokens
+DEFAULT_COMPLETION_TOKENS = 400
+# Per-message overhead of the chat format
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+@functools.lru_cache(maxsize=None)
+def _encoding(model: str):
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            # Models tiktoken does not know, such as other providers' judges
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        # Encodings are downloaded on first use; offline we fall back to a character estimate
+        return None
+
+
+def count_tokens(text: str, model: str = "gpt-4o") -> int:
+    """
+    Count the tokens in `text` for `model`, or estimate them at four characters per token.
+    """
+    encoding = _encoding(model)
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_prompt_tokens(request: dict) -> int:
+    """
+    Count the prompt tokens of a chat completion request.
+    """
+    model = request.get("model", "gpt-4o")
+    return sum(
+        count_tokens(str(message.get("content") or ""), model) + MESSAGE_OVERHEAD_TOKENS
+        for message in request.get("messages", [])
+    )
+
+
+def estimate_request_tokens(request: dict) -> int:
+    """
+    Estimate the tokens a chat completion request is charged against a tokens-per-minute budget.
+    """
+    return count_prompt_tokens(request) + (request.get("max_tokens") or DEFAULT_COMPLETION_TOKENS)
+
+
+def truncate_tokens(text: str, max_tokens: int, model: str = "gpt-4o") -> str:
+    """
+    Cut `text` to at most `max_tokens` tokens, marking the cut with "...".
+    """
+    if count_tokens(text, model) <= max_tokens:
+        return text
+    encoding = _encoding(model)
+    if encoding is None:
+        return text[:max_tokens * 4] + "..."
+    return encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens]) + "..."
+
+
+def _token_pieces(text: str, max_tokens: int, model: str) -> list:
+    encoding = _encoding(model)
+    if encoding is None:
+        size = max_tokens * 4
+        return [text[start:start + size] for start in range(0, len(text), size)]
+    tokens = encoding.encode(text, disallowed_special=())
+    return [encoding.decode(tokens[start:start + max_tokens]) for start in range(0, len(tokens), max_tokens)]
+
+
+def split_tokens(text: str, max_tokens: int, model: str = "gpt-4o") -> list:
+    """
+    Split `text` into windows of at most `max_tokens` tokens.
+
+    Windows break between lines, so conversation turns stay whole; a single
+    line longer than a window is cut on token boundaries.
+    """
+    windows, current, used = [], [], 0
+    for line in text.splitlines(keepends=True):
+        size = count_tokens(line, model)
+        if current and used + size > max_tokens:
+            windows.append("".join(current))
+            current, used = [], 0
+        if size > max_tokens:
+            windows.extend(_token_pieces(line, max_tokens, model))
+            continue
+        current.append(line)
+        used += size
+    if current or not windows:
+        windows.append("".join(current))
+    return windows
@@ -0,0 +1,58 @@
+import asyncio
+
+import pytest
+
+from llm_eval.scheduler import RateLimiter
+
+
+def run(coroutine):
+    return asyncio.run(asyncio.wait_for(coroutine, 10))
+
+
+def test_acquire_finishes_when_a_429_shrinks_the_budget_below_the_reservation():
+    async def scenario():
+        limiter = RateLimiter(6000, 6000)
+        limiter.available_tokens = 0
+        waiting = asyncio.ensure_future(limiter.acquire(5000))
+        await asyncio.sleep(0.05)
+        limiter.back_off(0)
+        # The halved budget fills up; the reservation has to shrink to fit it
+        limiter.available_tokens = limiter.tpm
+        await waiting
+
+    run(scenario())
+
+
+def test_acquire_finishes_when_headers_lower_the_token_limit():
+    async def scenario():
+        limiter = RateLimiter(6000, 30000)
+        limiter.available_tokens = 0
+        waiting = asyncio.ensure_future(limiter.acquire(8000))
+        await asyncio.sleep(0.05)
+        limiter.observe({"x-ratelimit-limit-tokens": "4000"})
+        limiter.available_tokens = limiter.tpm
+        await waiting
+
+    run(scenario())
+
+
+def test_waiting_request_does_not_hold_up_requests_that_fit():
+    async def scenario():
+        limiter = RateLimiter(6000, 6000)
+        limiter.available_tokens = 100
+        waiting = asyncio.ensure_future(limiter.acquire(5000))
+        await asyncio.sleep(0.05)
+        await asyncio.wait_for(limiter.acquire(50), 0.5)
+        assert not waiting.done()
+        waiting.cancel()
+
+    run(scenario())
+
+
+def test_rates_recover_over_time_after_a_429():
+    limiter = RateLimiter(600, 60000)
+    limiter.back_off(0)
+    assert limiter.rpm == pytest.approx(300, abs=1)
+    limiter.updated -= 30
+    limiter._refill()
+    assert limiter.rpm == 600